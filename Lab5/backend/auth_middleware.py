@@ -3,6 +3,7 @@ from flask import request, jsonify, make_response
 from auth_service import AuthService
 import jwt
 
+# Единственный экземпляр на процесс, app.py импортирует его отсюда
 auth_service = AuthService()
 
 def token_required(f):
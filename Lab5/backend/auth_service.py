@@ -5,10 +5,24 @@ from datetime import datetime, timedelta
 from flask import current_app
 import os
 import uuid
+from redis_client import get_redis
+
+# Ключи в Redis строятся по jti, а не по полному JWT:
+#   rt:{jti}      -> user_id   (refresh token)
+#   bl:{jti}      -> "1"       (черный список)
+#   ut:{user_id}  -> set(jti)  (refresh токены пользователя)
+# Старые ключи refresh_token:{JWT} и blacklist:{JWT} читаются, пока
+# AUTH_LEGACY_TOKEN_KEYS=1 (достаточно срока жизни refresh token, 7 дней)
+REFRESH_PREFIX = 'rt:'
+BLACKLIST_PREFIX = 'bl:'
+USER_TOKENS_PREFIX = 'ut:'
+LEGACY_REFRESH_PREFIX = 'refresh_token:'
+LEGACY_BLACKLIST_PREFIX = 'blacklist:'
+READ_LEGACY_KEYS = os.environ.get('AUTH_LEGACY_TOKEN_KEYS', '1') == '1'
 
 class AuthService:
     def __init__(self):
-        self.redis_client = redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+        self.redis_client = get_redis()
         self.jwt_secret = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
         self.access_token_expire = timedelta(hours=1)  # Увеличиваем до 1 часа для тестирования
         self.refresh_token_expire = timedelta(days=7)
@@ -32,37 +46,66 @@ class AuthService:
             'type': 'access',
             'exp': datetime.utcnow() + self.access_token_expire,
             'iat': datetime.utcnow(),
-            'jti': str(uuid.uuid4())  
+            'jti': uuid.uuid4().hex
         }
         return jwt.encode(payload, self.jwt_secret, algorithm='HS256')
     
-    def create_refresh_token(self, user_id: int, email: str) -> str:
-        """Создает refresh token"""
+    def mint_refresh_token(self, user_id: int, email: str) -> tuple:
+        """Подписывает refresh token без записи в Redis, возвращает (token, jti)"""
         payload = {
             'user_id': user_id,
             'email': email,
             'type': 'refresh',
             'exp': datetime.utcnow() + self.refresh_token_expire,
             'iat': datetime.utcnow(),
-            'jti': str(uuid.uuid4())
+            'jti': uuid.uuid4().hex
         }
-        token = jwt.encode(payload, self.jwt_secret, algorithm='HS256')
+        return jwt.encode(payload, self.jwt_secret, algorithm='HS256'), payload['jti']
+    
+    def create_refresh_token(self, user_id: int, email: str, pipe=None) -> str:
+        """Создает refresh token (если передан pipeline, запись в Redis ставится в него)"""
+        token, jti = self.mint_refresh_token(user_id, email)
         
-       
-        try:
-            ttl_seconds = int(self.refresh_token_expire.total_seconds())
-            print(f"Saving refresh token to Redis with TTL: {ttl_seconds} seconds")
-            result = self.redis_client.setex(
-                f"refresh_token:{token}",
-                ttl_seconds,
-                str(user_id)
-            )
-            print(f"Redis setex result: {result}")
-        except Exception as e:
-            print(f"Redis error: {e}")
+        own_pipe = pipe is None
+        if own_pipe:
+            pipe = self.redis_client.pipeline(transaction=False)
+        self.store_refresh_jti(pipe, jti, user_id)
+        if own_pipe:
+            try:
+                pipe.execute()
+            except redis.RedisError as e:
+                print(f"Redis error: {e}")
         
         return token
     
+    def store_refresh_jti(self, pipe, jti: str, user_id: int) -> None:
+        """Ставит в pipeline запись refresh token и индекс токенов пользователя"""
+        ttl_seconds = int(self.refresh_token_expire.total_seconds())
+        user_key = f"{USER_TOKENS_PREFIX}{user_id}"
+        pipe.setex(f"{REFRESH_PREFIX}{jti}", ttl_seconds, str(user_id))
+        pipe.sadd(user_key, jti)
+        pipe.expire(user_key, ttl_seconds)
+    
+    def token_jti(self, token: str):
+        """Достает jti из токена без проверки подписи и срока действия"""
+        try:
+            return jwt.decode(token, options={"verify_signature": False}).get('jti')
+        except jwt.InvalidTokenError:
+            return None
+    
+    def refresh_token_expiry(self, token: str):
+        """Срок действия (exp) подписанного этим сервером refresh token.
+
+        Просроченный токен подходит, поддельный или токен другого типа - нет
+        (None): иначе через logout можно наполнить черный список чужими jti."""
+        try:
+            payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'], options={"verify_exp": False})
+        except jwt.InvalidTokenError:
+            return None
+        if payload.get('type') != 'refresh' or not payload.get('exp'):
+            return None
+        return datetime.utcfromtimestamp(payload['exp'])
+    
     def verify_token(self, token: str, token_type: str = 'access') -> dict:
         """Проверяет токен и возвращает payload"""
         try:
@@ -73,7 +116,22 @@ class AuthService:
             
   
             if token_type == 'refresh':
-                if not self.redis_client.exists(f"refresh_token:{token}"):
+                # Проверка черного списка и наличия refresh token за один проход до Redis
+                jti = payload.get('jti')
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.exists(f"{BLACKLIST_PREFIX}{jti}")
+                pipe.exists(f"{REFRESH_PREFIX}{jti}")
+                if READ_LEGACY_KEYS:
+                    pipe.exists(f"{LEGACY_BLACKLIST_PREFIX}{token}")
+                    pipe.exists(f"{LEGACY_REFRESH_PREFIX}{token}")
+                    blacklisted, stored, legacy_blacklisted, legacy_stored = pipe.execute()
+                    blacklisted = blacklisted or legacy_blacklisted
+                    stored = stored or legacy_stored
+                else:
+                    blacklisted, stored = pipe.execute()
+                if blacklisted:
+                    raise jwt.InvalidTokenError('Token has been revoked')
+                if not stored:
                     raise jwt.InvalidTokenError('Refresh token not found')
             
             return payload
@@ -85,47 +143,103 @@ class AuthService:
     def revoke_refresh_token(self, token: str) -> bool:
         """Отзывает refresh token"""
         try:
-            return self.redis_client.delete(f"refresh_token:{token}") > 0
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.delete(f"{REFRESH_PREFIX}{self.token_jti(token)}")
+            if READ_LEGACY_KEYS:
+                pipe.delete(f"{LEGACY_REFRESH_PREFIX}{token}")
+            return sum(pipe.execute()) > 0
         except Exception:
             return False
     
     def revoke_all_user_tokens(self, user_id: int) -> int:
         """Отзывает все токены пользователя"""
-        pattern = f"refresh_token:*"
-        revoked_count = 0
+        user_key = f"{USER_TOKENS_PREFIX}{user_id}"
+        jtis = self.redis_client.smembers(user_key)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for jti in jtis:
+            pipe.delete(f"{REFRESH_PREFIX}{jti.decode('utf-8')}")
+        pipe.delete(user_key)
+        revoked_count = sum(pipe.execute()[:-1])
         
-        for key in self.redis_client.scan_iter(match=pattern):
-            token = key.decode('utf-8').replace('refresh_token:', '')
-            try:
-                payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'], options={"verify_exp": False})
-                if payload.get('user_id') == user_id:
-                    if self.redis_client.delete(key):
-                        revoked_count += 1
-            except jwt.InvalidTokenError:
-
-                self.redis_client.delete(key)
+        if READ_LEGACY_KEYS:
+            for key in self.redis_client.scan_iter(match=f"{LEGACY_REFRESH_PREFIX}*"):
+                token = key.decode('utf-8')[len(LEGACY_REFRESH_PREFIX):]
+                try:
+                    payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'], options={"verify_exp": False})
+                    if payload.get('user_id') == user_id:
+                        if self.redis_client.delete(key):
+                            revoked_count += 1
+                except jwt.InvalidTokenError:
+                    self.redis_client.delete(key)
         
         return revoked_count
     
     def blacklist_token(self, token: str, expires_at: datetime) -> bool:
         """Добавляет токен в черный список"""
         try:
-   
+            jti = self.token_jti(token)
             ttl = int((expires_at - datetime.utcnow()).total_seconds())
-            if ttl > 0:
-                self.redis_client.setex(f"blacklist:{token}", ttl, "1")
+            if jti and ttl > 0:
+                self.redis_client.setex(f"{BLACKLIST_PREFIX}{jti}", ttl, "1")
                 return True
             return False
         except Exception:
             return False
     
-    def is_token_blacklisted(self, token: str) -> bool:
+    def is_token_blacklisted(self, token: str, payload: dict = None) -> bool:
         """Проверяет, находится ли токен в черном списке"""
         try:
-            return self.redis_client.exists(f"blacklist:{token}") > 0
+            jti = payload.get('jti') if payload else self.token_jti(token)
+            keys = [f"{BLACKLIST_PREFIX}{jti}"]
+            if READ_LEGACY_KEYS:
+                keys.append(f"{LEGACY_BLACKLIST_PREFIX}{token}")
+            return self.redis_client.exists(*keys) > 0
         except Exception:
             return False
     
+    def migrate_legacy_token_keys(self, batch_size: int = 500) -> dict:
+        """Переносит ключи refresh_token:{JWT}/blacklist:{JWT} в формат по jti с сохранением TTL"""
+        stats = {'migrated': 0, 'dropped': 0}
+        for prefix in (LEGACY_REFRESH_PREFIX, LEGACY_BLACKLIST_PREFIX):
+            batch = []
+            for key in self.redis_client.scan_iter(match=f"{prefix}*", count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    self._migrate_batch(prefix, batch, stats)
+                    batch = []
+            if batch:
+                self._migrate_batch(prefix, batch, stats)
+        return stats
+    
+    def _migrate_batch(self, prefix: str, keys: list, stats: dict) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.pttl(key)
+        ttls = pipe.execute()
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, ttl_ms in zip(keys, ttls):
+            token = key.decode('utf-8')[len(prefix):]
+            try:
+                payload = jwt.decode(token, self.jwt_secret, algorithms=['HS256'], options={"verify_exp": False})
+            except jwt.InvalidTokenError:
+                payload = None
+            if payload is None or not payload.get('jti') or ttl_ms <= 0:
+                pipe.delete(key)
+                stats['dropped'] += 1
+                continue
+            jti = payload['jti']
+            if prefix == LEGACY_REFRESH_PREFIX:
+                user_key = f"{USER_TOKENS_PREFIX}{payload['user_id']}"
+                pipe.psetex(f"{REFRESH_PREFIX}{jti}", ttl_ms, str(payload['user_id']))
+                pipe.sadd(user_key, jti)
+                pipe.pexpire(user_key, int(self.refresh_token_expire.total_seconds() * 1000))
+            else:
+                pipe.psetex(f"{BLACKLIST_PREFIX}{jti}", ttl_ms, "1")
+            pipe.delete(key)
+            stats['migrated'] += 1
+        pipe.execute()
+    
     def refresh_access_token(self, refresh_token: str) -> dict:
         """Обновляет access token используя refresh token"""
         try:
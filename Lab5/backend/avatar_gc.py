@@ -0,0 +1,176 @@
+import os
+import re
+import time
+from avatars import AVATAR_GRACE_PERIOD
+
+# Раз в сколько секунд фоновая задача сверяет каталог аватаров, 0 - выключено
+AVATAR_GC_INTERVAL = int(os.environ.get('AVATAR_GC_INTERVAL', str(6 * 3600)))
+AVATAR_GC_BATCH = int(os.environ.get('AVATAR_GC_BATCH', '500'))
+AVATAR_GC_DRY_RUN = os.environ.get('AVATAR_GC_DRY_RUN', '0') == '1'
+
+# {avatar}_{size}.{fmt} принадлежит аватару {avatar}.jpg
+RENDITION = re.compile(r'^(?P<stem>.+)_\d+\.(webp|jpg)$')
+
+
+def owner_of(name):
+    match = RENDITION.match(name)
+    return f"{match.group('stem')}.jpg" if match else name
+
+
+class AvatarCollector:
+    """Сборщик мусора каталога аватаров.
+
+    Файлы проходятся пачками по batch_size: для каждой пачки одним
+    запросом выясняется, на какие из них ссылается Employee.avatar (сам
+    файл или аватар, рендишеном которого он является). Файлы без ссылок
+    старше grace удаляются под lock_avatar, как в release_avatar, чтобы не
+    гоняться с uploadAvatar. В каталоге spool удаляются брошенные
+    временные файлы старше grace."""
+
+    def __init__(self, app, db, model, upload_dir, lock=None, socketio=None,
+                 interval=AVATAR_GC_INTERVAL, batch_size=AVATAR_GC_BATCH, grace=AVATAR_GRACE_PERIOD,
+                 dry_run=AVATAR_GC_DRY_RUN):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.avatar_dir = os.path.join(upload_dir, 'avatars')
+        self.spool_dir = os.path.join(upload_dir, 'spool')
+        self.lock = lock
+        self.socketio = socketio
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace = grace
+        self.dry_run = dry_run
+        self._started = False
+
+    def start(self):
+        if self._started or not self.interval or self.socketio is None:
+            return
+        self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                report = self.collect()
+                print(f"Avatar GC: {self.format_report(report)}")
+            except Exception as e:
+                print(f"Avatar GC error: {e}")
+
+    def collect(self, dry_run=None):
+        """Один проход по каталогам, возвращает отчет"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        report = {
+            'dry_run': dry_run,
+            'scanned': 0,
+            'referenced': 0,
+            'recent': 0,
+            'removed': 0,
+            'reclaimed_bytes': 0,
+            'spool_removed': 0,
+            'errors': 0
+        }
+        cutoff = time.time() - self.grace
+
+        batch = []
+        for entry in self._scan(self.avatar_dir):
+            batch.append(entry)
+            if len(batch) >= self.batch_size:
+                self._collect_batch(batch, cutoff, dry_run, report)
+                batch = []
+        if batch:
+            self._collect_batch(batch, cutoff, dry_run, report)
+
+        for entry in self._scan(self.spool_dir):
+            if entry[2] < cutoff:
+                self._remove(entry, dry_run, report)
+                report['spool_removed'] += 1
+        return report
+
+    def _scan(self, directory):
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, entry.name, stat.st_mtime, stat.st_size
+
+    def _collect_batch(self, batch, cutoff, dry_run, report):
+        report['scanned'] += len(batch)
+        with self.app.app_context():
+            try:
+                referenced = self._referenced(batch)
+                candidates = []
+                for entry in batch:
+                    _, name, mtime, _ = entry
+                    if name in referenced or owner_of(name) in referenced:
+                        report['referenced'] += 1
+                    elif mtime >= cutoff:
+                        report['recent'] += 1
+                    else:
+                        candidates.append(entry)
+
+                if candidates and self.lock is not None and not dry_run:
+                    # Кандидаты перепроверяются под блокировками (в одном порядке),
+                    # uploadAvatar мог сослаться на файл после первого запроса
+                    for name in sorted({owner_of(name) for _, name, _, _ in candidates}):
+                        self.lock(name)
+                    referenced = self._referenced(candidates)
+
+                for entry in candidates:
+                    path, name, _, _ = entry
+                    if name in referenced or owner_of(name) in referenced:
+                        report['referenced'] += 1
+                        continue
+                    # process_avatar освежает mtime переиспользуемого файла без
+                    # блокировки: свежий mtime значит, что uploadAvatar еще впереди
+                    owner = os.path.join(self.avatar_dir, owner_of(name))
+                    if not dry_run and (self._recent(path, cutoff) or self._recent(owner, cutoff)):
+                        report['recent'] += 1
+                        continue
+                    self._remove(entry, dry_run, report)
+                    report['removed'] += 1
+            finally:
+                # Снимает advisory-блокировки пачки
+                self.db.session.commit()
+        if self.socketio is not None:
+            self.socketio.sleep(0)
+
+    @staticmethod
+    def _recent(path, cutoff):
+        try:
+            return os.path.getmtime(path) >= cutoff
+        except FileNotFoundError:
+            return False
+
+    def _referenced(self, entries):
+        names = {name for _, name, _, _ in entries} | {owner_of(name) for _, name, _, _ in entries}
+        rows = self.db.session.query(self.model.avatar).filter(self.model.avatar.in_(names)).all()
+        return {row[0] for row in rows}
+
+    def _remove(self, entry, dry_run, report):
+        path, _, _, size = entry
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                print(f"Avatar GC: cannot remove {path}: {e}")
+                report['errors'] += 1
+                return
+        report['reclaimed_bytes'] += size
+
+    @staticmethod
+    def format_report(report):
+        verb = 'would remove' if report['dry_run'] else 'removed'
+        return (f"scanned {report['scanned']}, referenced {report['referenced']}, "
+                f"kept (grace period) {report['recent']}, {verb} {report['removed']} "
+                f"+ {report['spool_removed']} spool files, "
+                f"{report['reclaimed_bytes'] / 1024:.1f} KB reclaimed, errors {report['errors']}")
@@ -0,0 +1,355 @@
+import base64
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+
+AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', '2'))
+# Сколько загрузок может ждать обработки, дальше upload отвечает 503
+AVATAR_MAX_PENDING = int(os.environ.get('AVATAR_MAX_PENDING', str(AVATAR_WORKERS * 8)))
+AVATAR_POLL_INTERVAL = float(os.environ.get('AVATAR_POLL_INTERVAL', '0.1'))
+# Сколько секунд хранить статус завершенной задачи для GET /api/avatars/jobs/<id>
+AVATAR_JOB_TTL = int(os.environ.get('AVATAR_JOB_TTL', '600'))
+# Квадраты рендишенов: 48/96 для списков (40 px при 1x и 2x), 300 для карточки
+AVATAR_SIZES = (48, 96, 300)
+# Крошечное превью для Employee.avatar_placeholder (data URI прямо в списках)
+PLACEHOLDER_SIZE = 16
+AVATAR_WEBP_QUALITY = int(os.environ.get('AVATAR_WEBP_QUALITY', '80'))
+AVATAR_JPEG_QUALITY = int(os.environ.get('AVATAR_JPEG_QUALITY', '85'))
+# Больше этого числа пикселей загрузка отклоняется по заголовку, до декодирования
+AVATAR_MAX_PIXELS = int(os.environ.get('AVATAR_MAX_PIXELS', str(40 * 1000 * 1000)))
+# Защита Pillow от decompression bomb в том же пороге (и в процессах пула)
+Image.MAX_IMAGE_PIXELS = AVATAR_MAX_PIXELS
+# Файлы моложе этого не удаляются при освобождении: загрузка уже готова,
+# но uploadAvatar еще не записал ссылку в Employee.avatar
+AVATAR_GRACE_PERIOD = int(os.environ.get('AVATAR_GRACE_PERIOD', '3600'))
+
+# Имена вида {sha256[:32]}.jpg и их рендишены: содержимое под таким именем не меняется
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{32}(_\d+)?\.(jpg|webp)$')
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP')
+)
+
+JOB_QUEUED = 'queued'
+JOB_READY = 'ready'
+JOB_FAILED = 'failed'
+
+
+def rendition_name(filename, size, fmt):
+    """{stem}.jpg - основной JPEG 300 px, остальные {stem}_{size}.{webp|jpg}"""
+    stem = os.path.splitext(filename)[0]
+    if fmt == 'jpg' and size == AVATAR_SIZES[-1]:
+        return f"{stem}.jpg"
+    return f"{stem}_{size}.{fmt}"
+
+
+def select_rendition(avatar_dir, filename, size=None, accept=''):
+    """Имя файла, который стоит отдать на запрос filename с ?size= и Accept.
+
+    Берется наименьший рендишен не меньше size, WebP - если клиент его
+    принимает. Старые аватары без рендишенов отдаются как есть."""
+    wanted = AVATAR_SIZES[-1]
+    if size:
+        wanted = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+    formats = ('webp', 'jpg') if 'image/webp' in (accept or '') else ('jpg',)
+    for fmt in formats:
+        name = rendition_name(filename, wanted, fmt)
+        if os.path.exists(os.path.join(avatar_dir, name)):
+            return name
+    return filename
+
+
+def avatar_etag(name, path):
+    """Сильный ETag: для хешированных имен само имя, для старых - mtime и размер"""
+    if CONTENT_ADDRESSED.match(name):
+        return os.path.splitext(name)[0] + '-' + os.path.splitext(name)[1][1:]
+    stat = os.stat(path)
+    return f"{int(stat.st_mtime)}-{stat.st_size}"
+
+
+def sniff_image(stream):
+    """Проверка загрузки до декодирования: сигнатура формата и размер из заголовка.
+
+    Возвращает формат, при недопустимом файле - ValueError с текстом для клиента."""
+    head = stream.read(16)
+    stream.seek(0)
+    fmt = next((f for signature, f in IMAGE_SIGNATURES if head.startswith(signature)), None)
+    if fmt is None:
+        raise ValueError('File is not a supported image')
+    try:
+        # Image.open читает только заголовок, пиксели не декодируются
+        with Image.open(stream, formats=[fmt]) as image:
+            width, height = image.size
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ValueError('Image is too large')
+    except (OSError, SyntaxError):
+        raise ValueError('Image file is corrupted')
+    finally:
+        stream.seek(0)
+    if width * height > AVATAR_MAX_PIXELS:
+        raise ValueError('Image is too large')
+    return fmt
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _flatten(image):
+    """RGB на белом фоне для JPEG (у PNG/GIF может быть прозрачность)"""
+    if image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image
+
+
+def rendition_names(filename):
+    names = [rendition_name(filename, size, fmt) for size in AVATAR_SIZES for fmt in ('webp', 'jpg')]
+    return names + [rendition_name(filename, PLACEHOLDER_SIZE, 'webp')]
+
+
+def is_safe_avatar_name(filename):
+    """Имя файла прямо в каталоге аватаров: без разделителей пути и '..'"""
+    return bool(filename) and filename not in ('.', '..') and '..' not in filename \
+        and '/' not in filename and '\\' not in filename and os.sep not in filename
+
+
+def placeholder_data_uri(avatar_dir, filename):
+    """data:image/webp;base64,... из превью 16 px, None для старых аватаров без него"""
+    if not is_safe_avatar_name(filename):
+        return None
+    try:
+        with open(os.path.join(avatar_dir, rendition_name(filename, PLACEHOLDER_SIZE, 'webp')), 'rb') as f:
+            return 'data:image/webp;base64,' + base64.b64encode(f.read()).decode('ascii')
+    except OSError:
+        return None
+
+
+def process_avatar(spool_path, avatar_dir):
+    """Выполняется в дочернем процессе: строит рендишены и удаляет исходник.
+
+    Каждый следующий размер уменьшается из предыдущего, а не из оригинала.
+    Имя - хеш основного JPEG 300 px: одинаковые загрузки дают один файл."""
+    work_name = os.path.basename(spool_path) + '.jpg'
+    work_dir = os.path.dirname(spool_path)
+    try:
+        with Image.open(spool_path) as source:
+            if source.format == 'JPEG':
+                # JPEG декодируется сразу в масштабе 1/2..1/8, но не меньше 300 px
+                source.draft(None, (AVATAR_SIZES[-1], AVATAR_SIZES[-1]))
+            # Поворот по EXIF (фото с телефона), затем RGB или RGBA для WebP и JPEG
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+        for size in sorted(AVATAR_SIZES, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            image.save(os.path.join(work_dir, rendition_name(work_name, size, 'webp')),
+                       'WEBP', quality=AVATAR_WEBP_QUALITY, method=4)
+            _flatten(image).save(os.path.join(work_dir, rendition_name(work_name, size, 'jpg')),
+                                 'JPEG', quality=AVATAR_JPEG_QUALITY, optimize=True, progressive=True)
+        # Превью 16 px: клиент растягивает его с размытием, пока грузится аватар
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.LANCZOS)
+        image.save(os.path.join(work_dir, rendition_name(work_name, PLACEHOLDER_SIZE, 'webp')),
+                   'WEBP', quality=50, method=6)
+
+        with open(os.path.join(work_dir, work_name), 'rb') as f:
+            filename = hashlib.sha256(f.read()).hexdigest()[:32] + '.jpg'
+        for work, final in zip(rendition_names(work_name), rendition_names(filename)):
+            work_path, final_path = os.path.join(work_dir, work), os.path.join(avatar_dir, final)
+            if os.path.exists(final_path):
+                # Такой аватар уже есть: свежий mtime защищает его от удаления до uploadAvatar
+                os.remove(work_path)
+                os.utime(final_path)
+            else:
+                os.replace(work_path, final_path)
+    finally:
+        os.remove(spool_path)
+        for work in rendition_names(work_name):
+            if os.path.exists(os.path.join(work_dir, work)):
+                os.remove(os.path.join(work_dir, work))
+    return filename
+
+
+class AvatarPipeline:
+    """Обработка аватаров вне потока запроса.
+
+    upload только сохраняет файл во временный каталог и ставит задачу в пул
+    процессов (не больше AVATAR_WORKERS одновременно). Фоновая задача
+    опрашивает futures через socketio.sleep, не блокируя eventlet, и по
+    завершении отправляет avatar_status в комнату user:{id} загрузившего.
+
+    Файлы именуются хешем содержимого и общие для всех сотрудников с таким
+    же аватаром; удалять их можно только через release, когда на них
+    больше нет ссылок из Employee.avatar."""
+
+    def __init__(self, socketio, upload_dir, workers=AVATAR_WORKERS, max_pending=AVATAR_MAX_PENDING,
+                 poll_interval=AVATAR_POLL_INTERVAL):
+        self.socketio = socketio
+        self.avatar_dir = os.path.join(upload_dir, 'avatars')
+        self.spool_dir = os.path.join(upload_dir, 'spool')
+        self.workers = workers
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn вместо fork: дочерний процесс не наследует открытые
+                # соединения с Postgres и Redis. Главный модуль при этом
+                # выполняется в нем заново как __mp_main__, поэтому сервер
+                # запускается через server.py, а не python app.py
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _reset_executor(self, broken):
+        """Пул, в котором умер процесс (segfault Pillow, OOM), больше не
+        принимает задачи: он заменяется новым при следующем обращении"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        print("Avatar worker pool is broken, restarting it")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, spool_path):
+        """(future, executor): по executor poll узнает, какой пул перезапускать"""
+        executor = self.executor
+        try:
+            return executor.submit(process_avatar, spool_path, self.avatar_dir), executor
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            executor = self.executor
+            return executor.submit(process_avatar, spool_path, self.avatar_dir), executor
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if job['status'] == JOB_QUEUED)
+
+    def submit(self, upload, user_id, employee_id):
+        """Сохраняет загрузку на диск и ставит ее в очередь; None, если очередь полна"""
+        if self.pending() >= self.max_pending:
+            return None
+        os.makedirs(self.spool_dir, exist_ok=True)
+        os.makedirs(self.avatar_dir, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(self.spool_dir, job_id)
+        self._spool(upload, spool_path)
+
+        job = {
+            'job_id': job_id,
+            'status': JOB_QUEUED,
+            'filename': None,
+            'employee_id': employee_id,
+            'user_id': user_id,
+            'error': None,
+            'finished_at': None
+        }
+        job['future'], job['executor'] = self._submit(spool_path)
+        with self._lock:
+            self.jobs[job_id] = job
+        return job
+
+    def _spool(self, upload, spool_path):
+        # Загрузка уже во временном файле на том же диске: жесткая ссылка вместо копии
+        name = getattr(upload.stream, 'name', None)
+        if isinstance(name, str) and os.path.exists(name):
+            upload.stream.flush()
+            try:
+                os.link(name, spool_path)
+                return
+            except OSError:
+                pass
+        upload.save(spool_path)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Avatar pipeline error: {e}")
+
+    def poll(self):
+        now = time.time()
+        finished = []
+        broken = set()
+        with self._lock:
+            for job_id, job in list(self.jobs.items()):
+                if job['status'] != JOB_QUEUED:
+                    if now - job['finished_at'] > AVATAR_JOB_TTL:
+                        del self.jobs[job_id]
+                    continue
+                if not job['future'].done():
+                    continue
+                error = job['future'].exception()
+                if isinstance(error, BrokenProcessPool):
+                    # Все задачи упавшего пула завершаются этой ошибкой
+                    broken.add(job['executor'])
+                    error = RuntimeError('Avatar processing worker crashed')
+                job['status'] = JOB_FAILED if error else JOB_READY
+                job['error'] = str(error) if error else None
+                job['filename'] = None if error else job['future'].result()
+                job['finished_at'] = now
+                finished.append(job)
+
+        for executor in broken:
+            self._reset_executor(executor)
+        for job in finished:
+            self.socketio.emit('avatar_status', self._public(job), to=f"user:{job['user_id']}")
+
+    def release(self, filename, references, grace=AVATAR_GRACE_PERIOD):
+        """Удаляет файлы аватара, если references() == 0 и файл не моложе grace.
+
+        Вызывать под lock_avatar(filename): иначе параллельный uploadAvatar
+        может сослаться на файл между подсчетом и удалением. Возвращает
+        число освобожденных байт."""
+        if not is_safe_avatar_name(filename):
+            print(f"Avatar release refused for unsafe name: {filename!r}")
+            return 0
+        main_path = os.path.join(self.avatar_dir, filename)
+        if not os.path.exists(main_path) or time.time() - os.path.getmtime(main_path) < grace:
+            return 0
+        if references() > 0:
+            return 0
+        freed = 0
+        for name in {filename, *rendition_names(filename)}:
+            path = os.path.join(self.avatar_dir, name)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    @staticmethod
+    def _public(job):
+        return {key: job[key] for key in ('job_id', 'status', 'filename', 'employee_id', 'error')}
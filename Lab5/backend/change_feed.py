@@ -0,0 +1,137 @@
+import calendar
+from datetime import date, datetime
+import redis
+from sqlalchemy import event, inspect
+
+# Счетчик версий сущности в Redis: общий для всех процессов
+VERSION_PREFIX = 'entity_version:'
+
+
+# Компактный формат (для MessagePack): короткие ключи, коды операций, время в секундах epoch
+OP_CODES = {'create': 0, 'update': 1, 'delete': 2}
+
+
+class ChangeEncoder:
+    """Готовит событие entity_changed к отправке.
+
+    Обычный формат - {entity, id, op, changes, version} с ISO-датами.
+    Компактный - {n, i, o, c, v}: даты и время в changes отправляются
+    секундами epoch (UTC), их поля перечислены в d (date) и t (datetime),
+    чтобы клиент вернул прежний вид."""
+
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def encode(self, entity, obj_id, op, changes, version) -> dict:
+        if not self.compact:
+            return {
+                'entity': entity,
+                'id': obj_id,
+                'op': op,
+                'changes': {name: self._iso(value) for name, value in changes.items()},
+                'version': version
+            }
+        values, dates, times = {}, [], []
+        for name, value in changes.items():
+            if isinstance(value, datetime):
+                value = calendar.timegm(value.utctimetuple())
+                times.append(name)
+            elif isinstance(value, date):
+                value = calendar.timegm(value.timetuple())
+                dates.append(name)
+            values[name] = value
+        payload = {'n': entity, 'i': obj_id, 'o': OP_CODES[op], 'c': values, 'v': version}
+        if dates:
+            payload['d'] = dates
+        if times:
+            payload['t'] = times
+        return payload
+
+    @staticmethod
+    def _iso(value):
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+
+
+class ChangeFeed:
+    """Рассылает компактные события об изменении сущностей после commit.
+
+    after_flush собирает измененные поля зарегистрированных моделей в
+    session.info, after_commit отправляет по одному событию
+    entity_changed {entity, id, op, changes, version} в комнаты сущности,
+    after_rollback отбрасывает накопленное."""
+
+    def __init__(self, socketio, redis_client, encoder=None):
+        self.socketio = socketio
+        self.redis_client = redis_client
+        self.encoder = encoder or ChangeEncoder()
+        self.models = {}
+
+    def register(self, model, entity, rooms):
+        """rooms(obj, old_values) -> список комнат, куда отправлять изменения obj"""
+        self.models[model] = (entity, rooms)
+
+    def attach(self, session):
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _after_flush(self, session, flush_context):
+        changes = session.info.setdefault('entity_changes', {})
+        for op, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+            for obj in objects:
+                spec = self.models.get(type(obj))
+                if spec is None:
+                    continue
+                values, old_values = self._changed_fields(obj, op)
+                if op == 'update' and not values:
+                    continue
+                # Комнаты считаются здесь: после commit атрибуты объекта уже
+                # просрочены, а SQL в after_commit выполнять нельзя
+                rooms = set(spec[1](obj, old_values))
+                key = (spec[0], obj.id)
+                pending = changes.get(key)
+                if pending is None:
+                    changes[key] = {'op': op, 'changes': values, 'rooms': rooms}
+                else:
+                    pending['changes'].update(values)
+                    pending['rooms'] |= rooms
+                    if op == 'delete':
+                        pending['op'] = op
+
+    def _changed_fields(self, obj, op):
+        values, old_values = {}, {}
+        state = inspect(obj)
+        for attr in state.mapper.column_attrs:
+            history = state.attrs[attr.key].history
+            if op == 'create' or history.has_changes():
+                values[attr.key] = getattr(obj, attr.key)
+                if history.deleted:
+                    old_values[attr.key] = history.deleted[0]
+        for rel in state.mapper.relationships:
+            if op == 'create' or state.attrs[rel.key].history.has_changes():
+                # Для связей отправляются только id, клиент сам решает, что дозагрузить
+                values[rel.key] = [related.id for related in getattr(obj, rel.key)]
+        return values, old_values
+
+    def _after_commit(self, session):
+        changes = session.info.pop('entity_changes', None)
+        if not changes:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for entity, obj_id in changes:
+                pipe.incr(f"{VERSION_PREFIX}{entity}:{obj_id}")
+            versions = pipe.execute()
+        except redis.RedisError as e:
+            print(f"Redis error: {e}")
+            versions = [None] * len(changes)
+
+        for ((entity, obj_id), change), version in zip(changes.items(), versions):
+            payload = self.encoder.encode(entity, obj_id, change['op'], change['changes'], version)
+            for room in change['rooms']:
+                self.socketio.emit('entity_changed', payload, to=room)
+
+    def _after_rollback(self, session):
+        session.info.pop('entity_changes', None)
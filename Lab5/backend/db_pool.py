@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from metrics import registry, DURATION_BUCKETS
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+# Соединения старше этого переоткрываются (обрывы со стороны Postgres/pgbouncer/NAT)
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+CHECKOUT_WAIT = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time waiting for a pooled connection', ('pool',),
+    (0.0001,) + DURATION_BUCKETS + (5.0, 10.0, 30.0))
+CHECKOUT_TIMEOUTS = registry.counter('db_pool_timeouts_total', 'Checkouts that hit pool_timeout', ('pool',))
+OVERFLOW_OPENED = registry.counter(
+    'db_pool_overflow_connections_total', 'Connections opened beyond pool_size', ('pool',))
+
+# Имя пула -> engine; пул читается при каждом рендере, engine.dispose() его пересоздает
+_engines = {}
+
+
+def _pool_stats(method):
+    return lambda: {(name,): getattr(engine.pool, method)() for name, engine in _engines.items()}
+
+
+registry.gauge('db_pool_checked_out', 'Connections currently in use', ('pool',), func=_pool_stats('checkedout'))
+registry.gauge('db_pool_checked_in', 'Idle connections in the pool', ('pool',), func=_pool_stats('checkedin'))
+registry.gauge('db_pool_overflow', 'Current overflow (negative while below pool_size)', ('pool',),
+               func=_pool_stats('overflow'))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который замеряет ожидание соединения в _do_get,
+    таймауты и открытие соединений сверх pool_size"""
+
+    metrics_name = 'primary'
+    _local = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get может вызвать себя повторно, замеряется только внешний вызов
+        if getattr(self._local, 'active', False):
+            return super()._do_get()
+        self._local.active = True
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            CHECKOUT_TIMEOUTS.inc(self.metrics_name)
+            raise
+        finally:
+            self._local.active = False
+            CHECKOUT_WAIT.observe(time.perf_counter() - start, self.metrics_name)
+
+    def _inc_overflow(self):
+        opened = super()._inc_overflow()
+        if opened and self._overflow > 0:
+            OVERFLOW_OPENED.inc(self.metrics_name)
+        return opened
+
+
+def instrumented_pool_class(name):
+    """Подкласс с меткой pool=name; recreate() сохраняет класс, а с ним и метку"""
+    return type(f"InstrumentedQueuePool_{name}", (InstrumentedQueuePool,), {'metrics_name': name})
+
+
+def engine_options(name='primary'):
+    """Параметры create_engine (SQLALCHEMY_ENGINE_OPTIONS) из окружения"""
+    return {
+        'poolclass': instrumented_pool_class(name),
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+
+def register_engine(name, engine):
+    """Включает пул engine в метрики db_pool_checked_out/checked_in/overflow"""
+    _engines[name] = engine
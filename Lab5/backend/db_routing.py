@@ -0,0 +1,133 @@
+import itertools
+import os
+import threading
+import time
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from db_pool import engine_options, register_engine
+from metrics import registry
+
+# Через запятую; пусто - все запросы идут в основную базу
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Реплика с отставанием больше этого (секунды) не используется
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+# Как часто перепроверять отставание каждой реплики
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+# Проверка отставания идет в потоке запроса: недоступная реплика не должна
+# держать его до системного TCP-таймаута
+DB_REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+
+# Без работающего WAL receiver реплика не получает изменений, хотя receive
+# и replay LSN совпадают: такая реплика считается недоступной (-1). Если
+# реплика догнала все полученное WAL, отставания нет, даже если на основной
+# базе давно не было записей и replay_timestamp старый
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN -1 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+ROUTED = registry.counter('db_routed_reads_total', 'GraphQL read requests by chosen database', ('target',))
+
+
+class ReplicaSet:
+    """Реплики для чтения с проверкой отставания.
+
+    choose() по кругу отдает реплику, отставание которой не больше
+    max_lag; отставание перепроверяется не чаще раза в check_interval
+    секунд. Если подходящих реплик нет, возвращает None (читать с основной)."""
+
+    def __init__(self, urls=DATABASE_REPLICA_URLS, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_CHECK_INTERVAL):
+        self.engines = []
+        for index, url in enumerate(urls):
+            name = f"replica{index}"
+            engine = create_engine(url, connect_args={'connect_timeout': DB_REPLICA_CONNECT_TIMEOUT},
+                                   **engine_options(name))
+            register_engine(name, engine)
+            self.engines.append(engine)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = {}
+        self._checked_at = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        registry.gauge('db_replica_lag_seconds', 'Last measured replica lag, -1 if unreachable or not streaming', ('replica',),
+                       func=lambda: {(f"replica{i}",): lag for i, lag in self.lag.items()})
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def choose(self):
+        healthy = [engine for index, engine in enumerate(self.engines) if self._healthy(index)]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def _healthy(self, index):
+        now = time.monotonic()
+        with self._lock:
+            fresh = now - self._checked_at.get(index, float('-inf')) < self.check_interval
+            if not fresh:
+                # Остальные потоки до конца проверки используют прошлое значение
+                self._checked_at[index] = now
+        if not fresh:
+            self.lag[index] = self._measure_lag(self.engines[index])
+        lag = self.lag.get(index, -1)
+        return 0 <= lag <= self.max_lag
+
+    def _measure_lag(self, engine):
+        try:
+            with engine.connect() as conn:
+                return float(conn.execute(REPLICA_LAG_SQL).scalar() or 0)
+        except Exception as e:
+            print(f"Replica lag check failed: {e}")
+            return -1
+
+
+def route_reads_to_replica():
+    """Текущий запрос только читает (GraphQL query): следующие SELECT можно
+    отправлять на реплику, пока в этом же запросе не было записи"""
+    if has_request_context():
+        g.db_read_only = True
+
+
+def route_to_primary():
+    """Текущий запрос пишет (mutation): до его конца все идет в основную базу,
+    включая чтения после записи"""
+    if has_request_context():
+        g.db_read_only = False
+        g.db_wrote = True
+
+
+class RoutingSession(Session):
+    """Сессия Flask-SQLAlchemy, отправляющая чтения запросов-query на реплики.
+
+    Реплика выбирается один раз на HTTP-запрос, чтобы все его чтения
+    видели одно состояние. flush, mutation и все, что вне запроса
+    (фоновые задачи, скрипты), идет в основную базу."""
+
+    def __init__(self, db, replicas=None, **kwargs):
+        super().__init__(db, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.replicas:
+            replica = self._replica_bind()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_bind(self):
+        if not has_request_context():
+            return None
+        if self._flushing:
+            g.db_wrote = True
+            return None
+        if not g.get('db_read_only') or g.get('db_wrote'):
+            return None
+        if 'db_replica' not in g:
+            g.db_replica = self.replicas.choose()
+            ROUTED.inc('replica' if g.db_replica is not None else 'primary_fallback')
+        return g.db_replica
@@ -0,0 +1,163 @@
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+
+DOCUMENT_MAX_SIZE = int(os.environ.get('DOCUMENT_MAX_SIZE', str(1024 * 1024 * 1024)))
+# Рекомендуемый размер чанка для клиента; один PUT все равно ограничен MAX_CONTENT_LENGTH
+DOCUMENT_CHUNK_SIZE = int(os.environ.get('DOCUMENT_CHUNK_SIZE', str(8 * 1024 * 1024)))
+COPY_BUFFER = 64 * 1024
+# Загрузка, в которую столько секунд не приходило чанков, считается брошенной
+DOCUMENT_UPLOAD_TTL = int(os.environ.get('DOCUMENT_UPLOAD_TTL', str(24 * 3600)))
+# Раз в сколько секунд удалять брошенные загрузки, 0 - выключено
+DOCUMENT_EXPIRE_INTERVAL = int(os.environ.get('DOCUMENT_EXPIRE_INTERVAL', '3600'))
+
+
+class ChunkError(Exception):
+    """Чанк не принят; offset - текущая позиция, с которой клиенту продолжать"""
+
+    def __init__(self, message, offset, status=400):
+        super().__init__(message)
+        self.offset = offset
+        self.status = status
+
+
+class DocumentStore:
+    """Локальное хранилище документов с докачкой.
+
+    Незавершенная загрузка - файл documents/.parts/{upload_id}, его длина и
+    есть принятый offset, поэтому продолжить можно и после перезапуска.
+    Готовый файл лежит под своим sha256: documents/{sha[:2]}/{sha}.
+    Данные всегда копируются потоком по COPY_BUFFER байт. append, complete,
+    discard и expire работают с файлом загрузки под flock; если файла уже
+    нет (загрузка завершена или удалена), ChunkError со статусом 404."""
+
+    def __init__(self, upload_dir):
+        self.root = os.path.join(upload_dir, 'documents')
+        self.parts_dir = os.path.join(self.root, '.parts')
+
+    def part_path(self, upload_id):
+        return os.path.join(self.parts_dir, upload_id)
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def create(self):
+        os.makedirs(self.parts_dir, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        open(self.part_path(upload_id), 'wb').close()
+        return upload_id
+
+    def offset(self, upload_id):
+        try:
+            return os.path.getsize(self.part_path(upload_id))
+        except FileNotFoundError:
+            raise ChunkError('Upload not found', 0, 404)
+
+    def _open_part(self, upload_id):
+        """Файл загрузки под исключительной блокировкой (снимается при закрытии)"""
+        path = self.part_path(upload_id)
+        try:
+            part = open(path, 'r+b')
+        except FileNotFoundError:
+            raise ChunkError('Upload not found', 0, 404)
+        fcntl.flock(part, fcntl.LOCK_EX)
+        # Пока ждали блокировку, complete мог перенести файл, а discard - удалить
+        try:
+            same = os.stat(path).st_ino == os.fstat(part.fileno()).st_ino
+        except FileNotFoundError:
+            same = False
+        if not same:
+            part.close()
+            raise ChunkError('Upload not found', 0, 404)
+        return part
+
+    def append(self, upload_id, stream, offset, total_size, chunk_sha256=None):
+        """Дописывает тело запроса с позиции offset, возвращает новый offset.
+
+        offset должен совпадать с уже принятым размером (иначе 409 и
+        актуальный offset). При несовпадении контрольной суммы чанка файл
+        обрезается обратно, чанк можно отправить заново."""
+        # Параллельный PUT той же загрузки ждет блокировку и увидит новый offset
+        with self._open_part(upload_id) as part:
+            current = os.fstat(part.fileno()).st_size
+            if offset != current:
+                raise ChunkError('Offset does not match uploaded size', current, 409)
+            part.seek(current)
+            digest = hashlib.sha256()
+            written = 0
+            try:
+                while True:
+                    data = stream.read(COPY_BUFFER)
+                    if not data:
+                        break
+                    written += len(data)
+                    if current + written > total_size:
+                        raise ChunkError('Chunk exceeds declared file size', current)
+                    digest.update(data)
+                    part.write(data)
+                if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+                    raise ChunkError('Chunk checksum mismatch', current)
+            except Exception:
+                part.truncate(current)
+                raise
+            part.flush()
+            os.fsync(part.fileno())
+            return current + written
+
+    def complete(self, upload_id, total_size, sha256=None):
+        """Проверяет размер и sha256 целиком, переносит файл в хранилище.
+
+        Возвращает (sha256, size). Одинаковые документы хранятся одним файлом."""
+        path = self.part_path(upload_id)
+        with self._open_part(upload_id) as part:
+            size = os.fstat(part.fileno()).st_size
+            if size != total_size:
+                raise ChunkError('Upload is incomplete', size, 409)
+            digest = hashlib.sha256()
+            for data in iter(lambda: part.read(COPY_BUFFER), b''):
+                digest.update(data)
+            actual = digest.hexdigest()
+            if sha256 and actual != sha256.lower():
+                raise ChunkError('File checksum mismatch', size)
+
+            # Перенос под блокировкой: ждущие append/complete увидят, что файла нет
+            target = self.object_path(actual)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                os.remove(path)
+            else:
+                os.replace(path, target)
+        return actual, size
+
+    def discard(self, upload_id):
+        try:
+            with self._open_part(upload_id):
+                os.remove(self.part_path(upload_id))
+        except ChunkError:
+            pass
+
+    def expire(self, max_age=DOCUMENT_UPLOAD_TTL):
+        """Удаляет файлы загрузок, не менявшиеся max_age секунд; возвращает их upload_id.
+
+        Загрузка, в которую прямо сейчас пишется чанк (блокировка занята), пропускается."""
+        if not os.path.isdir(self.parts_dir):
+            return []
+        cutoff = time.time() - max_age
+        expired = []
+        for upload_id in os.listdir(self.parts_dir):
+            path = self.part_path(upload_id)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                with open(path, 'r+b') as part:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if os.fstat(part.fileno()).st_mtime >= cutoff or \
+                            os.stat(path).st_ino != os.fstat(part.fileno()).st_ino:
+                        continue
+                    os.remove(path)
+                    expired.append(upload_id)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+        return expired
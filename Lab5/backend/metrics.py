@@ -0,0 +1,243 @@
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+
+# Границы гистограмм по умолчанию: секунды для длительностей
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Размер emit считается повторным кодированием payload, поэтому только у
+# каждого N-го emit события; большие события (полные снимки) не измеряются
+SOCKETIO_SIZE_SAMPLE = int(os.environ.get('SOCKETIO_METRICS_SIZE_SAMPLE', '10'))
+SOCKETIO_UNSIZED_EVENTS = frozenset(
+    event.strip() for event in os.environ.get('SOCKETIO_METRICS_UNSIZED_EVENTS', 'presence_snapshot').split(',')
+    if event.strip())
+
+
+def _labels_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.label_names, values)} {total}")
+        return lines
+
+
+class Gauge:
+    """Значение задается явно или вычисляется функцией при каждом чтении;
+    для метрики с метками функция возвращает словарь по значениям меток"""
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values):
+        if self.func is not None:
+            value = self.func()
+            return value.get(label_values, 0) if isinstance(value, dict) else value
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if self.func is not None:
+            value = self.func()
+            # Функция метрики с метками возвращает {значения меток: значение}
+            if isinstance(value, dict):
+                for values, item in sorted(value.items()):
+                    lines.append(f"{self.name}{_labels_text(self.label_names, values)} {item}")
+            else:
+                lines.append(f"{self.name} {value}")
+            return lines
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.label_names, values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    labels = _labels_text(self.label_names + ('le',), values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _labels_text(self.label_names, values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Простой реестр метрик процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self._add(Gauge(name, help_text, labels, func))
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class SocketIOMetrics:
+    """Метрики слоя Socket.IO: события и время их обработки, получатели,
+    байты и длительность каждого emit, число подключенных клиентов.
+
+    Байты (socketio_emit_bytes, socketio_delivered_bytes_total) считаются
+    по выборке: каждый sample_every-й emit события, кроме unsized_events."""
+
+    def __init__(self, socketio, encode_size, registry=registry,
+                 sample_every=SOCKETIO_SIZE_SAMPLE, unsized_events=SOCKETIO_UNSIZED_EVENTS):
+        self.socketio = socketio
+        self.encode_size = encode_size
+        self.sample_every = max(sample_every, 1)
+        self.unsized_events = unsized_events
+        self._emit_seen = {}
+        self.events = registry.counter('socketio_events_total', 'Received Socket.IO events', ('event',))
+        self.errors = registry.counter('socketio_handler_errors_total', 'Socket.IO handler exceptions', ('event',))
+        self.handler_seconds = registry.histogram(
+            'socketio_handler_duration_seconds', 'Socket.IO handler duration', ('event',))
+        self.emits = registry.counter('socketio_emits_total', 'Socket.IO emit calls', ('event',))
+        self.recipients = registry.histogram(
+            'socketio_emit_recipients', 'Local recipients per emit', ('event',), COUNT_BUCKETS)
+        self.emit_bytes = registry.histogram(
+            'socketio_emit_bytes', 'Payload bytes per sampled emit', ('event',), BYTES_BUCKETS)
+        self.delivered_bytes = registry.counter(
+            'socketio_delivered_bytes_total', 'Payload bytes times recipients of sampled emits', ('event',))
+        self.emit_seconds = registry.histogram(
+            'socketio_emit_duration_seconds', 'Time spent inside emit', ('event',))
+        self.connected = registry.gauge('socketio_connected_clients', 'Connected Socket.IO clients')
+
+    def on(self, event):
+        """Замена @socketio.on: регистрирует обработчик и оборачивает его метриками"""
+        def decorator(handler):
+            @wraps(handler)
+            def instrumented(*args, **kwargs):
+                self.events.inc(event)
+                start = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                except Exception:
+                    self.errors.inc(event)
+                    raise
+                finally:
+                    self.handler_seconds.observe(time.perf_counter() - start, event)
+            return self.socketio.on(event)(instrumented)
+        return decorator
+
+    def instrument_emit(self):
+        """Оборачивает socketio.emit; flask_socketio.emit тоже идет через него"""
+        original = self.socketio.emit
+
+        @wraps(original)
+        def emit(event, *args, **kwargs):
+            recipients = self._recipients(kwargs)
+            size = self.encode_size(args) if self._sampled(event) else None
+            start = time.perf_counter()
+            try:
+                return original(event, *args, **kwargs)
+            finally:
+                self.emit_seconds.observe(time.perf_counter() - start, event)
+                self.emits.inc(event)
+                self.recipients.observe(recipients, event)
+                if size is not None:
+                    self.emit_bytes.observe(size, event)
+                    self.delivered_bytes.inc(event, amount=size * recipients)
+
+        self.socketio.emit = emit
+
+    def _sampled(self, event):
+        if event in self.unsized_events:
+            return False
+        seen = self._emit_seen.get(event, 0)
+        self._emit_seen[event] = seen + 1
+        return seen % self.sample_every == 0
+
+    def _recipients(self, kwargs):
+        # Получатели в этом процессе; при очереди сообщений остальные процессы считают своих
+        to = kwargs.get('to') or kwargs.get('room')
+        namespace = kwargs.get('namespace') or '/'
+        try:
+            rooms = self.socketio.server.manager.rooms.get(namespace, {})
+            count = len(rooms.get(to, ()))
+        except AttributeError:
+            return 0
+        skip = kwargs.get('skip_sid')
+        if skip or kwargs.get('include_self') is False:
+            count -= len(skip) if isinstance(skip, list) else 1
+        return max(count, 0)
@@ -0,0 +1,487 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from timer_wheel import HashedTimerWheel
+
+STATUS_ACTIVE = 'active'
+STATUS_IDLE = 'idle'
+STATUS_OFFLINE = 'offline'
+
+# Сколько живет запись присутствия в Redis без обновлений, секунды
+PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', '600'))
+
+# Компактный формат (для MessagePack): короткие ключи, коды статусов, last_seen в секундах epoch
+STATUS_CODES = {STATUS_ACTIVE: 0, STATUS_IDLE: 1, STATUS_OFFLINE: 2}
+COMPACT_KEYS = {'user_id': 'u', 'email': 'e', 'role': 'r', 'last_seen': 't', 'status': 's'}
+
+
+class PresenceEncoder:
+    """Готовит записи присутствия к отправке.
+
+    Внутри last_seen хранится в секундах epoch. Обычный формат совпадает
+    с прежним JSON (ISO-время, полные ключи), компактный - короткие ключи
+    и коды статусов. Внутренние поля (sid) наружу не попадают."""
+
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def entry(self, entry) -> dict:
+        if self.compact:
+            return {
+                COMPACT_KEYS[name]: STATUS_CODES.get(value, value) if name == 'status' else value
+                for name, value in entry.items() if name in COMPACT_KEYS
+            }
+        out = {name: value for name, value in entry.items() if name in COMPACT_KEYS}
+        if out.get('last_seen') is not None:
+            out['last_seen'] = datetime.utcfromtimestamp(out['last_seen']).isoformat()
+        return out
+
+    def delta(self, delta) -> dict:
+        joined = [self.entry(e) for e in delta['joined']]
+        changed = [self.entry(e) for e in delta['changed']]
+        if self.compact:
+            return {'v': delta['version'], 'j': joined, 'l': delta['left'], 'c': changed}
+        return {'version': delta['version'], 'joined': joined, 'left': delta['left'], 'changed': changed}
+
+    def snapshot(self, snapshot) -> dict:
+        if self.compact:
+            return {'v': snapshot['version'], 'u': [self.entry(e) for e in snapshot['users'].values()]}
+        return {
+            'version': snapshot['version'],
+            'users': {user_id: self.entry(e) for user_id, e in snapshot['users'].items()}
+        }
+
+
+class PresenceRegistry:
+    """Хранит присутствие пользователей и выдает версионированные изменения.
+
+    Изменения копятся в буфере и сворачиваются по пользователю: flush()
+    выдает одну дельту {'version', 'joined', 'left', 'changed'} за тик,
+    version растет на 1 с каждой дельтой. Клиент применяет дельты по
+    порядку версий: дельты разных процессов идут через очередь сообщений
+    и могут прийти переставленными, поэтому клиент их придерживает и
+    запрашивает полный снимок, только если недостающая так и не пришла.
+
+    Переходы active -> idle -> offline -> удаление выполняет сам сервер
+    по колесу таймеров: idle через idle_after секунд без активности,
+    offline через offline_after, удаление еще через evict_after."""
+
+    def __init__(self, store=None, idle_after=30, offline_after=300, evict_after=None):
+        self.users = {}
+        # Двусторонний индекс сессий: у пользователя может быть несколько вкладок
+        self.sessions = {}
+        self.sid_user = {}
+        # Комнаты: room -> {user_id: число сессий в комнате}, sid -> set(room)
+        self.room_members = {}
+        self.sid_rooms = {}
+        self.version = 0
+        self.store = store
+        self.idle_after = idle_after
+        self.offline_after = offline_after
+        self.evict_after = evict_after if evict_after is not None else idle_after
+        self.wheel = HashedTimerWheel(tick=1.0, slots=max(64, int(offline_after) + 1))
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        # С общим хранилищем снимок берется из него: там пользователи всех процессов
+        if self.store is not None:
+            return self.store.snapshot()
+        with self._lock:
+            return {'version': self.version, 'users': {uid: dict(entry) for uid, entry in self.users.items()}}
+
+    def set_online(self, user_id, sid, email, role) -> bool:
+        with self._lock:
+            self.sid_user[sid] = user_id
+            self.sessions.setdefault(user_id, set()).add(sid)
+            entry = self.users.get(user_id)
+            if entry is None:
+                entry = {
+                    'user_id': user_id,
+                    'email': email,
+                    'role': role,
+                    'last_seen': int(time.time()),
+                    'status': STATUS_ACTIVE
+                }
+                self.users[user_id] = entry
+                self._mark(user_id, 'joined', entry)
+            else:
+                entry['last_seen'] = int(time.time())
+                entry['status'] = STATUS_ACTIVE
+                self._mark(user_id, 'changed', self._changed(entry, {'status': STATUS_ACTIVE, 'last_seen': entry['last_seen']}))
+            self._schedule(user_id, STATUS_ACTIVE)
+        if self.store is not None:
+            self.store.add_session(user_id, sid)
+        return True
+
+    def touch(self, user_id) -> bool:
+        """Активность пользователя: обновляет last_seen и возвращает статус active"""
+        with self._lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                return False
+            entry['last_seen'] = int(time.time())
+            fields = {'last_seen': entry['last_seen']}
+            if entry['status'] != STATUS_ACTIVE:
+                entry['status'] = fields['status'] = STATUS_ACTIVE
+            self._mark(user_id, 'changed', self._changed(entry, fields))
+            self._schedule(user_id, STATUS_ACTIVE)
+            return True
+
+    def set_status(self, user_id, status) -> bool:
+        with self._lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                return False
+            entry['status'] = status
+            entry['last_seen'] = int(time.time())
+            self._mark(user_id, 'changed', self._changed(entry, {'status': status, 'last_seen': entry['last_seen']}))
+            self._schedule(user_id, status)
+            return True
+
+    def remove_sid(self, sid) -> bool:
+        """Закрывает сессию за O(1); пользователь уходит офлайн только с последней сессией"""
+        with self._lock:
+            user_id = self.sid_user.pop(sid, None)
+            if user_id is None:
+                return False
+            sids = self.sessions.get(user_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.sessions[user_id]
+            local_left = user_id not in self.sessions
+        # Каждый закрытый sid убирается из общего набора, иначе он остается в
+        # presence:sessions и последняя вкладка выглядит открытой в другом процессе
+        remaining = self.store.remove_session(user_id, sid) if self.store is not None else 0
+        if not local_left:
+            return False
+        with self._lock:
+            if user_id in self.sessions:
+                return False
+            self.wheel.cancel(user_id)
+            if self.users.pop(user_id, None) is None:
+                return False
+            if remaining > 0:
+                # Сессии пользователя еще открыты в других процессах
+                self._pending.pop(user_id, None)
+                return False
+            self._mark(user_id, 'left')
+            return True
+
+    def join_room(self, room, sid, user_id) -> bool:
+        """Добавляет сессию в комнату; True, если пользователь только что в ней появился"""
+        with self._lock:
+            rooms = self.sid_rooms.setdefault(sid, set())
+            if room in rooms:
+                return False
+            rooms.add(room)
+        return self._room_incr(room, user_id, 1) == 1
+
+    def leave_room(self, room, sid, user_id) -> bool:
+        """Убирает сессию из комнаты; True, если это была последняя сессия пользователя в ней"""
+        with self._lock:
+            rooms = self.sid_rooms.get(sid)
+            if not rooms or room not in rooms:
+                return False
+            rooms.discard(room)
+            if not rooms:
+                del self.sid_rooms[sid]
+        return self._room_incr(room, user_id, -1) == 0
+
+    def leave_all_rooms(self, sid, user_id) -> list:
+        """При отключении: комнаты, которые пользователь покинул полностью"""
+        with self._lock:
+            rooms = self.sid_rooms.pop(sid, set())
+        return [room for room in rooms if self._room_incr(room, user_id, -1) == 0]
+
+    def room_viewers(self, room) -> list:
+        """Кто сейчас в комнате (во всех процессах при общем хранилище)"""
+        if self.store is not None:
+            return self.store.room_viewers(room)
+        with self._lock:
+            return [self._viewer(user_id) for user_id in self.room_members.get(room, {})]
+
+    def viewer(self, user_id) -> dict:
+        with self._lock:
+            return self._viewer(user_id)
+
+    def _viewer(self, user_id):
+        entry = self.users.get(user_id) or {}
+        return {'user_id': user_id, 'email': entry.get('email'), 'role': entry.get('role'), 'status': entry.get('status')}
+
+    def _room_incr(self, room, user_id, delta) -> int:
+        if self.store is not None:
+            return self.store.room_incr(room, user_id, delta)
+        with self._lock:
+            members = self.room_members.setdefault(room, {})
+            count = members.get(user_id, 0) + delta
+            if count > 0:
+                members[user_id] = count
+            else:
+                members.pop(user_id, None)
+                if not members:
+                    del self.room_members[room]
+            return max(count, 0)
+
+    def expire(self) -> int:
+        """Шаг колеса таймеров: понижает статусы и удаляет просроченных, возвращает число переходов.
+
+        С общим хранилищем таймер этого процесса видит только свои сессии:
+        если другой процесс отметил активность позже, понижение откладывается,
+        а если у пользователя остались сессии в других процессах, удаляется
+        только локальная запись (как в remove_sid)."""
+        with self._lock:
+            expired = self.wheel.advance()
+            due = [(user_id, status) for user_id, status in expired
+                   if user_id in self.users and self.users[user_id]['status'] == status]
+        remote = self.store.user_state([user_id for user_id, _ in due]) if self.store is not None and due else {}
+        with self._lock:
+            for user_id, status in due:
+                entry = self.users.get(user_id)
+                if entry is None or entry['status'] != status:
+                    continue
+                sessions, last_seen = remote.get(user_id, (0, None))
+                if status == STATUS_OFFLINE:
+                    del self.users[user_id]
+                    if sessions > len(self.sessions.get(user_id, ())):
+                        self._pending.pop(user_id, None)
+                    else:
+                        self._mark(user_id, 'left')
+                    continue
+                if last_seen is not None and last_seen > entry['last_seen']:
+                    entry['last_seen'] = last_seen
+                    self._schedule(user_id, status)
+                    continue
+                entry['status'] = STATUS_IDLE if status == STATUS_ACTIVE else STATUS_OFFLINE
+                self._mark(user_id, 'changed', self._changed(entry, {'status': entry['status']}))
+                self._schedule(user_id, entry['status'])
+            return len(expired)
+
+    def _changed(self, entry, fields):
+        # В общее хранилище уходит запись целиком: если ключ пользователя был
+        # удален другим процессом, следующее изменение восстановит его полностью
+        if self.store is not None:
+            return {name: entry[name] for name in COMPACT_KEYS if name in entry}
+        return fields
+
+    def _schedule(self, user_id, status):
+        # Значение таймера - статус, из которого пользователь будет понижен
+        if status == STATUS_ACTIVE:
+            delay = self.idle_after
+        elif status == STATUS_IDLE:
+            delay = self.offline_after - self.idle_after
+        else:
+            delay = self.evict_after
+        self.wheel.schedule(user_id, delay, status)
+
+    def flush(self):
+        """Сворачивает накопленные изменения в одну дельту (None, если изменений нет)"""
+        with self._lock:
+            if not self._pending:
+                return None
+            pending, self._pending = self._pending, {}
+            joined, left, changed = [], [], []
+            for user_id, (kind, fields) in pending.items():
+                if kind == 'joined':
+                    joined.append(dict(self.users.get(user_id, fields)))
+                elif kind == 'left':
+                    left.append(user_id)
+                else:
+                    changed.append(dict(fields, user_id=user_id))
+            if self.store is not None:
+                self.version = self.store.publish(joined, left, changed)
+            else:
+                self.version += 1
+            return {
+                'version': self.version,
+                'joined': joined,
+                'left': left,
+                'changed': changed
+            }
+
+    def refresh_store(self):
+        """Продлевает TTL записей в общем хранилище для пользователей и комнат этого процесса"""
+        if self.store is None:
+            return
+        with self._lock:
+            user_ids = list(self.users)
+            rooms = set().union(*self.sid_rooms.values()) if self.sid_rooms else set()
+        if user_ids or rooms:
+            self.store.refresh(user_ids, rooms)
+
+    def _mark(self, user_id, kind, fields=None):
+        # joined и left перекрывают все предыдущее, changed дописывается
+        # в уже ожидающую запись того же пользователя
+        prev = self._pending.get(user_id)
+        if kind == 'changed' and prev is not None and prev[0] != 'left':
+            prev[1].update(fields)
+            return
+        self._pending[user_id] = (kind, dict(fields or {}))
+
+
+class RedisPresenceStore:
+    """Общее для всех процессов присутствие в Redis.
+
+    presence:user:{user_id}     - hash с полями записи (TTL PRESENCE_TTL),
+    presence:sessions:{user_id} - set sid всех процессов,
+    presence:room:{room}        - hash "{user_id}:{worker}" -> число сессий
+                                  пользователя в комнате в процессе worker,
+    presence:worker:{worker}    - признак живого процесса (TTL PRESENCE_TTL),
+    presence:online             - zset user_id -> время последнего обновления,
+    presence:version            - общий счетчик версий дельт.
+
+    Счетчики комнат раздельные по процессам: счетчики упавшего процесса
+    (его presence:worker истек) удаляет room_viewers, хотя сам hash
+    комнаты продлевают живые процессы."""
+
+    FIELDS = ('email', 'role', 'last_seen', 'status')
+
+    # Изменение счетчика и удаление обнулившегося поля атомарно; возвращает
+    # число сессий пользователя в комнате во всех процессах
+    ROOM_INCR_LUA = """
+    local count = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    if count <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+    local prefix = ARGV[4]
+    local total = 0
+    local fields = redis.call('HGETALL', KEYS[1])
+    for i = 1, #fields, 2 do
+        if string.sub(fields[i], 1, #prefix) == prefix then
+            total = total + tonumber(fields[i + 1])
+        end
+    end
+    return total
+    """
+
+    def __init__(self, client, ttl=PRESENCE_TTL, prefix='presence:', worker_id=None):
+        self.client = client
+        self.ttl = ttl
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.worker_prefix = f"{prefix}worker:"
+        self.worker_key = f"{self.worker_prefix}{self.worker_id}"
+        self._room_incr = client.register_script(self.ROOM_INCR_LUA)
+        self.online_key = f"{prefix}online"
+        self.version_key = f"{prefix}version"
+        self.user_prefix = f"{prefix}user:"
+        self.sessions_prefix = f"{prefix}sessions:"
+        self.room_prefix = f"{prefix}room:"
+
+    def publish(self, joined, left, changed) -> int:
+        """Записывает дельту одним MULTI и возвращает ее глобальную версию"""
+        now = time.time()
+        pipe = self.client.pipeline(transaction=True)
+        for entry in joined + changed:
+            key = f"{self.user_prefix}{entry['user_id']}"
+            fields = {name: entry[name] for name in self.FIELDS if entry.get(name) is not None}
+            if fields:
+                pipe.hset(key, mapping=fields)
+            pipe.expire(key, self.ttl)
+            pipe.zadd(self.online_key, {entry['user_id']: now})
+        for user_id in left:
+            pipe.delete(f"{self.user_prefix}{user_id}")
+            pipe.zrem(self.online_key, user_id)
+        pipe.incr(self.version_key)
+        return pipe.execute()[-1]
+
+    def add_session(self, user_id, sid):
+        key = f"{self.sessions_prefix}{user_id}"
+        pipe = self.client.pipeline(transaction=False)
+        pipe.sadd(key, sid)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def remove_session(self, user_id, sid) -> int:
+        """Удаляет сессию и возвращает число оставшихся сессий пользователя во всех процессах"""
+        key = f"{self.sessions_prefix}{user_id}"
+        pipe = self.client.pipeline(transaction=True)
+        pipe.srem(key, sid)
+        pipe.scard(key)
+        return pipe.execute()[-1]
+
+    def user_state(self, user_ids) -> dict:
+        """user_id -> (число сессий во всех процессах, last_seen из общей записи или None)"""
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.scard(f"{self.sessions_prefix}{user_id}")
+            pipe.hget(f"{self.user_prefix}{user_id}", 'last_seen')
+        results = pipe.execute()
+        return {
+            user_id: (results[2 * i], int(results[2 * i + 1]) if results[2 * i + 1] else None)
+            for i, user_id in enumerate(user_ids)
+        }
+
+    def refresh(self, user_ids, rooms=()):
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.expire(f"{self.user_prefix}{user_id}", self.ttl)
+            pipe.expire(f"{self.sessions_prefix}{user_id}", self.ttl)
+            pipe.zadd(self.online_key, {user_id: now})
+        for room in rooms:
+            pipe.expire(f"{self.room_prefix}{room}", self.ttl)
+        pipe.set(self.worker_key, '1', ex=self.ttl)
+        pipe.execute()
+
+    def room_incr(self, room, user_id, delta) -> int:
+        count = self._room_incr(
+            keys=[f"{self.room_prefix}{room}", self.worker_key],
+            args=[f"{user_id}:{self.worker_id}", delta, self.ttl, f"{user_id}:"])
+        return max(int(count), 0)
+
+    def room_viewers(self, room) -> list:
+        key = f"{self.room_prefix}{room}"
+        members = {}
+        for field, count in self.client.hgetall(key).items():
+            user_id, _, worker = field.decode('utf-8').partition(':')
+            members[field] = (int(user_id), worker, int(count))
+        workers = sorted({worker for _, worker, _ in members.values() if worker})
+        pipe = self.client.pipeline(transaction=False)
+        for worker in workers:
+            pipe.exists(f"{self.worker_prefix}{worker}")
+        alive = {worker for worker, exists in zip(workers, pipe.execute() if workers else []) if exists}
+        dead = [field for field, (_, worker, _) in members.items() if worker not in alive]
+        if dead:
+            self.client.hdel(key, *dead)
+        user_ids = sorted({user_id for user_id, worker, count in members.values() if worker in alive and count > 0})
+
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hmget(f"{self.user_prefix}{user_id}", 'email', 'role', 'status')
+        viewers = []
+        for user_id, (email, role, status) in zip(user_ids, pipe.execute() if user_ids else []):
+            viewers.append({
+                'user_id': user_id,
+                'email': email.decode('utf-8') if email else None,
+                'role': role.decode('utf-8') if role else None,
+                'status': status.decode('utf-8') if status else None
+            })
+        return viewers
+
+    def snapshot(self) -> dict:
+        # Версия читается до записей: если записи окажутся новее, следующая
+        # дельта применится к ним повторно без последствий
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self.version_key)
+        pipe.zremrangebyscore(self.online_key, '-inf', time.time() - self.ttl)
+        pipe.zrange(self.online_key, 0, -1)
+        version, _, user_ids = pipe.execute()
+
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hgetall(f"{self.user_prefix}{user_id.decode('utf-8')}")
+        users = {}
+        for user_id, raw in zip(user_ids, pipe.execute()):
+            if not raw or b'email' not in raw:
+                continue
+            entry = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+            entry['user_id'] = int(user_id)
+            if 'last_seen' in entry:
+                entry['last_seen'] = int(entry['last_seen'])
+            users[entry['user_id']] = entry
+        return {'version': int(version or 0), 'users': users}
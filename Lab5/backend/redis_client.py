@@ -0,0 +1,42 @@
+import os
+import threading
+import redis
+
+# Один пул соединений на процесс: AuthService и остальные модули
+# берут клиента отсюда, а не создают свой через redis.from_url
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '2'))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', '2'))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', '30'))
+
+_pool = None
+_client = None
+_lock = threading.RLock()
+
+
+def get_redis_pool() -> redis.ConnectionPool:
+    """Возвращает общий пул соединений Redis"""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool.from_url(
+                    REDIS_URL,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                    retry_on_timeout=True
+                )
+    return _pool
+
+
+def get_redis() -> redis.Redis:
+    """Возвращает общий клиент Redis поверх общего пула"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.Redis(connection_pool=get_redis_pool())
+    return _client
@@ -0,0 +1,31 @@
+"""Удаляет файлы аватаров, на которые не ссылается ни один Employee.avatar.
+
+Запуск из каталога backend:
+    python scripts/avatar_gc.py --dry-run
+    python scripts/avatar_gc.py --batch-size 1000 --grace 3600
+
+Файлы моложе --grace секунд не трогаются: загрузка могла завершиться, а
+uploadAvatar еще не записал ссылку. Заодно чистится каталог uploads/spool.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Employee, lock_avatar
+from avatar_gc import AvatarCollector, AVATAR_GC_BATCH
+from avatars import AVATAR_GRACE_PERIOD
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборка мусора в каталоге аватаров')
+    parser.add_argument('--dry-run', action='store_true', help='только отчет, без удаления')
+    parser.add_argument('--batch-size', type=int, default=AVATAR_GC_BATCH)
+    parser.add_argument('--grace', type=int, default=AVATAR_GRACE_PERIOD, help='секунды')
+    args = parser.parse_args()
+
+    collector = AvatarCollector(app, db, Employee, app.config['UPLOAD_FOLDER'], lock=lock_avatar,
+                                batch_size=args.batch_size, grace=args.grace)
+    report = collector.collect(dry_run=args.dry_run)
+    print(AvatarCollector.format_report(report))
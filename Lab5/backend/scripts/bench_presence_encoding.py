@@ -0,0 +1,125 @@
+"""Размер на проводе и время кодирования событий присутствия и entity_changed: JSON против MessagePack.
+
+Запуск из каталога backend:
+    python scripts/bench_presence_encoding.py --users 1000 --repeat 200
+
+Сравниваются полные пакеты Socket.IO (как их кодирует python-socketio)
+для снимка присутствия, типичной дельты активности и entity_changed
+после создания сотрудника (все поля, включая даты).
+"""
+import argparse
+from datetime import date, datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socketio import packet, msgpack_packet
+from presence import PresenceEncoder, STATUS_ACTIVE, STATUS_IDLE, STATUS_OFFLINE
+from change_feed import ChangeEncoder
+
+
+def make_users(count):
+    now = 1_760_000_000
+    roles = ('user', 'manager', 'admin')
+    statuses = (STATUS_ACTIVE, STATUS_IDLE, STATUS_OFFLINE)
+    return {
+        user_id: {
+            'user_id': user_id,
+            'sid': f"{random.getrandbits(80):020x}",
+            'email': f"employee{user_id}@hr.com",
+            'role': random.choice(roles),
+            'last_seen': now - random.randint(0, 300),
+            'status': random.choice(statuses)
+        }
+        for user_id in range(1, count + 1)
+    }
+
+
+def make_delta(users, changed):
+    sample = random.sample(list(users), changed)
+    return {
+        'version': 42,
+        'joined': [],
+        'left': [],
+        'changed': [{'user_id': uid, 'last_seen': users[uid]['last_seen'], 'status': STATUS_ACTIVE} for uid in sample]
+    }
+
+
+def make_employee_change():
+    return {
+        'id': 1042,
+        'first_name': 'Ivan',
+        'last_name': 'Petrov',
+        'email': 'employee1042@hr.com',
+        'position': 'Backend Developer',
+        'department': 'Engineering',
+        'hire_date': date(2023, 3, 15),
+        'salary': 185000.0,
+        'skills': '["Python", "PostgreSQL", "Redis"]',
+        'performance_score': 4.5,
+        'avatar': '3f2a9c0d4b1e8f7a6c5d2e1b0a9f8e7d.jpg',
+        'created_at': datetime(2026, 10, 19, 9, 30, 12, 345678),
+        'projects': [3, 7, 12]
+    }
+
+
+def wire_size(encoded):
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+
+def measure(name, event, payload, packet_class, repeat):
+    def encode():
+        return packet_class(packet.EVENT, data=[event, payload]).encode()
+
+    size = wire_size(encode())
+    seconds = min(timeit.repeat(encode, number=repeat, repeat=3)) / repeat
+    print(f"  {name:<28} {size:>9} B  {seconds * 1e6:>9.1f} us/encode")
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--changed', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(1)
+    users = make_users(args.users)
+    delta = make_delta(users, min(args.changed, args.users))
+    # Прежний формат: словарь active_users целиком, с sid и ISO-временем
+    legacy = {uid: dict(PresenceEncoder().entry(e), sid=e['sid']) for uid, e in users.items()}
+
+    json_enc = PresenceEncoder(compact=False)
+    compact_enc = PresenceEncoder(compact=True)
+
+    print(f"presence_snapshot, {args.users} users:")
+    base = measure('legacy users_status_update', 'users_status_update', legacy, packet.Packet, args.repeat)
+    measure('json', 'presence_snapshot', json_enc.snapshot({'version': 1, 'users': users}), packet.Packet, args.repeat)
+    size = measure('msgpack compact', 'presence_snapshot', compact_enc.snapshot({'version': 1, 'users': users}),
+                   msgpack_packet.MsgPackPacket, args.repeat)
+    print(f"  msgpack compact / legacy: {size / base:.2%}")
+
+    print(f"presence_delta, {len(delta['changed'])} changed:")
+    base = measure('json', 'presence_delta', json_enc.delta(delta), packet.Packet, args.repeat)
+    size = measure('msgpack compact', 'presence_delta', compact_enc.delta(delta),
+                   msgpack_packet.MsgPackPacket, args.repeat)
+    print(f"  msgpack compact / json: {size / base:.2%}")
+
+    change = make_employee_change()
+    print("entity_changed, employee create:")
+    base = measure('json', 'entity_changed', ChangeEncoder().encode('employee', 1042, 'create', change, 1),
+                   packet.Packet, args.repeat)
+    size = measure('msgpack compact', 'entity_changed',
+                   ChangeEncoder(compact=True).encode('employee', 1042, 'create', change, 1),
+                   msgpack_packet.MsgPackPacket, args.repeat)
+    print(f"  msgpack compact / json: {size / base:.2%}")
+
+
+if __name__ == '__main__':
+    main()
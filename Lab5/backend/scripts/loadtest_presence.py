@@ -0,0 +1,391 @@
+"""Нагрузочный тест подсистемы присутствия через Socket.IO.
+
+Запуск из каталога backend (сервер уже поднят локально):
+    pip install "python-socketio[client]"
+    python scripts/loadtest_presence.py --users 1000 --workers 4 --duration 120 \\
+        --server-pid $(pgrep -f "python server.py" | head -1) --create-users
+
+Каждый симулированный пользователь логинится через GraphQL (cookie
+access_token), подключается к Socket.IO, отправляет user_online, затем
+user_activity раз в --activity-interval секунд, user_status_update и
+join_room/leave_room по комнатам project:{k} со случайными интервалами.
+
+Пользователи делятся между --workers процессами. Задержка доставки
+считается только на --observers клиентах (иначе число пар растет как N^2):
+для каждого полученного изменения берутся все действия этого пользователя
+с момента предыдущего изменения, которое видел наблюдатель. Все процессы
+на одной машине, поэтому отметки time.time() сравнимы.
+
+Отчет: перцентили задержки (presence_delta и room_presence), CPU сервера
+по /proc/<pid>/stat, усиление рассылки по клиентам (получено / отправлено)
+и по /metrics сервера (доставленные байты / байты emit).
+"""
+import argparse
+import base64
+import bisect
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import socketio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presence import STATUS_ACTIVE, STATUS_IDLE, STATUS_CODES
+
+LOGIN_MUTATION = 'mutation($email: String!, $password: String!) { login(email: $email, password: $password) { message } }'
+REGISTER_MUTATION = 'mutation($email: String!, $password: String!) { register(email: $email, password: $password) { message } }'
+
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def graphql(opener, url, query, variables):
+    body = json.dumps({'query': query, 'variables': variables}).encode()
+    req = urllib.request.Request(f"{url}/graphql", data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with opener.open(req, timeout=30) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b'{}')
+
+
+def login_cookie(url, email, password, create):
+    """Логин через GraphQL, возвращает заголовок Cookie с access_token"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    variables = {'email': email, 'password': password}
+    result = graphql(opener, url, LOGIN_MUTATION, variables)
+    if result.get('errors') and create:
+        graphql(opener, url, REGISTER_MUTATION, variables)
+        result = graphql(opener, url, LOGIN_MUTATION, variables)
+    if result.get('errors'):
+        raise RuntimeError(f"{email}: {result['errors'][0].get('message')}")
+    return '; '.join(f"{c.name}={c.value}" for c in jar if c.name == 'access_token')
+
+
+def decode_entry(entry):
+    """(user_id, status) из обычной или компактной записи присутствия"""
+    if 'u' in entry:
+        return entry['u'], STATUS_NAMES.get(entry.get('s'), entry.get('s'))
+    return entry['user_id'], entry.get('status')
+
+
+class SimulatedUser:
+    def __init__(self, index, args, log):
+        self.index = index
+        self.args = args
+        self.log = log
+        self.email = f"{args.email_prefix}{index}@loadtest.local"
+        self.user_id = None
+        self.rooms = set()
+        self.observer = False
+        self.client = socketio.Client(reconnection=False, serializer='msgpack' if args.msgpack else 'default')
+        self.client.on('presence_snapshot', self.on_snapshot)
+        self.client.on('presence_delta', self.on_delta)
+        self.client.on('room_presence', self.on_room_presence)
+
+    def connect(self, cookie):
+        self.client.connect(self.args.url, headers={'Cookie': cookie}, transports=['websocket'])
+
+    def on_snapshot(self, data):
+        self.log.count('presence_snapshot')
+
+    def on_delta(self, data):
+        self.log.count('presence_delta')
+        if not self.observer:
+            return
+        now = time.time()
+        changed = data.get('changed', data.get('c', [])) + data.get('joined', data.get('j', []))
+        for entry in changed:
+            user_id, _ = decode_entry(entry)
+            self.log.receive('presence', self.index, user_id, now)
+
+    def on_room_presence(self, data):
+        self.log.count('room_presence')
+        if not self.observer:
+            return
+        now = time.time()
+        for entry in data.get('joined', []):
+            user_id, _ = decode_entry(entry)
+            self.log.receive('room', self.index, (data.get('room'), user_id), now)
+
+    def emit(self, event, data=None):
+        self.log.count_sent(event)
+        self.client.emit(event, data)
+
+    def run(self, deadline):
+        args = self.args
+        self.emit('user_online')
+        self.log.send('presence', self.user_id, time.time())
+        next_activity = time.time() + random.uniform(0, args.activity_interval)
+        next_status = time.time() + random.expovariate(1 / args.status_interval)
+        next_room = time.time() + random.expovariate(1 / args.room_interval)
+        while time.time() < deadline and self.client.connected:
+            now = time.time()
+            if now >= next_activity:
+                self.emit('user_activity')
+                self.log.send('presence', self.user_id, now)
+                next_activity = now + args.activity_interval
+            if now >= next_status:
+                self.emit('user_status_update', {'status': random.choice((STATUS_ACTIVE, STATUS_IDLE))})
+                self.log.send('presence', self.user_id, now)
+                next_status = now + random.expovariate(1 / args.status_interval)
+            if now >= next_room:
+                self.toggle_room(now)
+                next_room = now + random.expovariate(1 / args.room_interval)
+            time.sleep(max(0, min(next_activity, next_status, next_room, deadline) - time.time()))
+        self.client.disconnect()
+
+    def toggle_room(self, now):
+        if self.rooms and random.random() < 0.5:
+            room = self.rooms.pop()
+            self.emit('leave_room', {'room': room})
+            return
+        room = f"project:{random.randint(1, self.args.rooms)}"
+        if room in self.rooms:
+            return
+        self.rooms.add(room)
+        self.log.send('room', (room, self.user_id), now)
+        self.emit('join_room', {'room': room})
+
+
+class WorkerLog:
+    """Журнал одного процесса: отправленные действия и то, что увидели наблюдатели"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sends = {'presence': [], 'room': []}
+        self.receipts = {'presence': [], 'room': []}
+        self.received = {}
+        self.sent = {}
+        self.errors = 0
+
+    def send(self, kind, key, at):
+        with self.lock:
+            self.sends[kind].append((key, at))
+
+    def receive(self, kind, observer, key, at):
+        with self.lock:
+            self.receipts[kind].append((observer, key, at))
+
+    def count(self, event):
+        with self.lock:
+            self.received[event] = self.received.get(event, 0) + 1
+
+    def count_sent(self, event):
+        with self.lock:
+            self.sent[event] = self.sent.get(event, 0) + 1
+
+
+def user_id_of(cookie):
+    # Полезная нагрузка JWT без проверки подписи: нужен только user_id
+    token = cookie.split('=', 1)[1]
+    payload = token.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))['user_id']
+
+
+def run_worker(worker, indices, observers, args, start_at, results):
+    random.seed(args.seed * 1000 + worker)
+    log = WorkerLog()
+    users = []
+    for index in indices:
+        user = SimulatedUser(index, args, log)
+        user.observer = index in observers
+        try:
+            cookie = login_cookie(args.url, user.email, args.password, args.create_users)
+            user.user_id = user_id_of(cookie)
+            user.connect(cookie)
+            users.append(user)
+        except Exception as e:
+            log.errors += 1
+            print(f"[worker {worker}] {user.email}: {e}")
+        time.sleep(1 / args.ramp)
+
+    # Все процессы начинают нагрузку одновременно, после подключения всех клиентов
+    time.sleep(max(0, start_at - time.time()))
+    deadline = start_at + args.duration
+    threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(args.duration + 30)
+
+    results.put({
+        'connected': len(users),
+        'errors': log.errors,
+        'sends': log.sends,
+        'receipts': log.receipts,
+        'received': log.received,
+        'sent': log.sent
+    })
+
+
+def latencies(sends, receipts):
+    """Для каждого изменения, увиденного наблюдателем, задержка всех действий
+    пользователя с момента предыдущего изменения у того же наблюдателя"""
+    by_key = {}
+    for key, at in sends:
+        by_key.setdefault(key, []).append(at)
+    for times in by_key.values():
+        times.sort()
+
+    samples = []
+    last_seen = {}
+    for observer, key, at in sorted(receipts, key=lambda r: r[2]):
+        times = by_key.get(key)
+        if not times:
+            continue
+        since = last_seen.get((observer, key), 0)
+        lo = bisect.bisect_right(times, since)
+        hi = bisect.bisect_right(times, at)
+        samples.extend(at - t for t in times[lo:hi])
+        last_seen[(observer, key)] = at
+    return samples
+
+
+def percentiles(samples, points=(50, 90, 95, 99, 99.9)):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def cpu_seconds(pid):
+    """utime + stime процесса из /proc/<pid>/stat (Linux)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+METRIC_LINE = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def scrape_metrics(url):
+    """Суммы метрик /metrics по имени (без разбивки по меткам)"""
+    totals = {}
+    try:
+        with urllib.request.urlopen(f"{url}/metrics", timeout=10) as resp:
+            text = resp.read().decode()
+    except (urllib.error.URLError, OSError):
+        return None
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match and 'le=' not in (match.group(2) or ''):
+            totals[match.group(1)] = totals.get(match.group(1), 0.0) + float(match.group(3))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест присутствия через Socket.IO')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--observers', type=int, default=20, help='клиенты, замеряющие задержку')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--ramp', type=float, default=50, help='подключений в секунду на процесс')
+    parser.add_argument('--rooms', type=int, default=20, help='число комнат project:{k}')
+    parser.add_argument('--activity-interval', type=float, default=10)
+    parser.add_argument('--status-interval', type=float, default=60, help='среднее между user_status_update')
+    parser.add_argument('--room-interval', type=float, default=30, help='среднее между join/leave')
+    parser.add_argument('--email-prefix', default='loadtest')
+    parser.add_argument('--password', default='loadtest123')
+    parser.add_argument('--create-users', action='store_true', help='регистрировать недостающих пользователей')
+    parser.add_argument('--msgpack', action='store_true', help='сервер запущен с SOCKETIO_SERIALIZER=msgpack')
+    parser.add_argument('--server-pid', type=int, help='pid сервера для замера CPU')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    indices = list(range(1, args.users + 1))
+    observers = set(random.sample(indices, min(args.observers, len(indices))))
+    shards = [indices[w::args.workers] for w in range(args.workers)]
+
+    # Время на логин и подключение: bcrypt на сервере обычно самое медленное место
+    start_at = time.time() + max(len(shard) for shard in shards) / args.ramp + 5
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=run_worker, args=(w, shard, observers, args, start_at, results))
+        for w, shard in enumerate(shards)
+    ]
+    for proc in procs:
+        proc.start()
+
+    time.sleep(max(0, start_at - time.time()))
+    metrics_before = scrape_metrics(args.url)
+    cpu_before = cpu_seconds(args.server_pid) if args.server_pid else None
+    wall_start = time.time()
+
+    reports = [results.get() for _ in procs]
+    wall = time.time() - wall_start
+    cpu_after = cpu_seconds(args.server_pid) if args.server_pid else None
+    metrics_after = scrape_metrics(args.url)
+    for proc in procs:
+        proc.join()
+
+    sends = {'presence': [], 'room': []}
+    receipts = {'presence': [], 'room': []}
+    received, sent = {}, {}
+    for report in reports:
+        for kind in sends:
+            sends[kind].extend(report['sends'][kind])
+            receipts[kind].extend(report['receipts'][kind])
+        for event, n in report['received'].items():
+            received[event] = received.get(event, 0) + n
+        for event, n in report['sent'].items():
+            sent[event] = sent.get(event, 0) + n
+
+    print(f"Users: {sum(r['connected'] for r in reports)} connected, {sum(r['errors'] for r in reports)} failed, "
+          f"{args.workers} workers, {wall:.1f} s")
+
+    print("\nDelivery latency (ms):")
+    for kind, label in (('presence', 'presence_delta'), ('room', 'room_presence')):
+        samples = latencies(sends[kind], receipts[kind])
+        stats = percentiles(samples)
+        line = '  '.join(f"p{p:g}={v * 1000:.0f}" for p, v in stats.items()) or 'no samples'
+        print(f"  {label:<16} n={len(samples):<8} {line}")
+
+    print("\nClient traffic:")
+    total_sent = sum(sent.values())
+    total_received = sum(received.values())
+    for event, n in sorted(sent.items()):
+        print(f"  sent     {event:<20} {n:>10}  {n / wall:>8.1f}/s")
+    for event, n in sorted(received.items()):
+        print(f"  received {event:<20} {n:>10}  {n / wall:>8.1f}/s")
+    if total_sent:
+        print(f"  amplification (messages received / sent): {total_received / total_sent:.1f}x")
+
+    if cpu_before is not None:
+        used = cpu_after - cpu_before
+        print(f"\nServer CPU: {used:.1f} s over {wall:.1f} s ({used / wall * 100:.0f}% of one core)")
+
+    if metrics_before and metrics_after:
+        def diff(name):
+            return metrics_after.get(name, 0) - metrics_before.get(name, 0)
+        emits = diff('socketio_emits_total')
+        emit_bytes = diff('socketio_emit_bytes_sum')
+        print("\nServer metrics (this process only):")
+        print(f"  events handled: {diff('socketio_events_total'):.0f}, emits: {emits:.0f}, "
+              f"handler errors: {diff('socketio_handler_errors_total'):.0f}")
+        sized = diff('socketio_emit_bytes_count')
+        if emits and emit_bytes and sized:
+            # Байты сервер считает по выборке emit (без presence_snapshot),
+            # итоговые объемы - оценка по среднему размеру выборки
+            amplification = diff('socketio_delivered_bytes_total') / emit_bytes
+            emitted = emit_bytes / sized * emits
+            print(f"  recipients per emit: {diff('socketio_emit_recipients_sum') / emits:.1f}")
+            print(f"  amplification (delivered bytes / emitted bytes, sampled): {amplification:.1f}x")
+            print(f"  emitted: ~{emitted / 1024:.0f} KB, delivered: ~{emitted * amplification / 1024:.0f} KB "
+                  f"({sized:.0f} of {emits:.0f} emits sized)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Сравнение памяти Redis для старых ключей (полный JWT) и ключей по jti.
+
+Запуск из каталога backend:
+    python scripts/measure_token_keys.py --sessions 100000 --db 15
+
+Скрипт очищает выбранную базу Redis (FLUSHDB), поэтому используйте
+отдельный номер базы, а не ту, с которой работает приложение.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from auth_service import AuthService, REFRESH_PREFIX, USER_TOKENS_PREFIX, LEGACY_REFRESH_PREFIX
+
+
+def used_memory(client):
+    return client.info('memory')['used_memory']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--url', default=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.url, db=args.db)
+    service = AuthService()
+    service.redis_client = client
+    ttl = int(service.refresh_token_expire.total_seconds())
+
+    results = {}
+    for fmt in ('legacy', 'jti'):
+        client.flushdb()
+        base = used_memory(client)
+        pipe = client.pipeline(transaction=False)
+        for i in range(args.sessions):
+            user_id = i % 1000 + 1
+            if fmt == 'legacy':
+                token = service.create_refresh_token(user_id, f"user{user_id}@hr.com", pipe=_NullPipe())
+                pipe.setex(f"{LEGACY_REFRESH_PREFIX}{token}", ttl, str(user_id))
+            else:
+                service.create_refresh_token(user_id, f"user{user_id}@hr.com", pipe=pipe)
+            if (i + 1) % 1000 == 0:
+                pipe.execute()
+        pipe.execute()
+        results[fmt] = used_memory(client) - base
+        sample = next(client.scan_iter(match=f"{LEGACY_REFRESH_PREFIX if fmt == 'legacy' else REFRESH_PREFIX}*"))
+        print(f"{fmt:>6}: {results[fmt] / 1024 / 1024:8.2f} MiB total, "
+              f"{results[fmt] / args.sessions:7.1f} B/session, "
+              f"sample key {len(sample)} B, MEMORY USAGE {client.memory_usage(sample)} B")
+
+    client.flushdb()
+    saved = results['legacy'] - results['jti']
+    print(f" saved: {saved / 1024 / 1024:8.2f} MiB ({saved / results['legacy'] * 100:.1f}%) "
+          f"for {args.sessions} sessions, включая индекс {USER_TOKENS_PREFIX}{{user_id}}")
+
+
+class _NullPipe:
+    """Pipeline-заглушка: нужна только чтобы получить строку токена без записи в Redis"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+if __name__ == '__main__':
+    main()
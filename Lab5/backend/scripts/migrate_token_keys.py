@@ -0,0 +1,19 @@
+"""Переносит ключи refresh_token:{JWT}/blacklist:{JWT} в формат по jti.
+
+Запуск из каталога backend:
+    python scripts/migrate_token_keys.py
+
+Безопасен для повторного запуска. После миграции (или через 7 дней, когда
+старые ключи истекут сами) можно выставить AUTH_LEGACY_TOKEN_KEYS=0.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth_service import AuthService
+
+
+if __name__ == '__main__':
+    stats = AuthService().migrate_legacy_token_keys()
+    print(f"Migrated: {stats['migrated']}, dropped (invalid or expired): {stats['dropped']}")
@@ -0,0 +1,10 @@
+"""Точка входа backend: python server.py.
+
+Пул аватаров запускает процессы через spawn, а они заново выполняют главный
+модуль как __mp_main__. Здесь это пустая операция: app.py со всей
+инициализацией (eventlet.monkey_patch, Socket.IO, Redis, движки БД и
+реплики) импортируется только в основном процессе."""
+
+if __name__ == '__main__':
+    import app
+    app.main()
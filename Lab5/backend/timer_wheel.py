@@ -0,0 +1,51 @@
+import time
+
+
+class HashedTimerWheel:
+    """Хешированное колесо таймеров.
+
+    Таймер попадает в слот (deadline_tick % slots); schedule и cancel
+    работают за O(1), а один шаг колеса просматривает только свой слот.
+    Таймеры дальше одного оборота остаются в слоте до нужного тика."""
+
+    def __init__(self, tick=1.0, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.clock = clock
+        self.current_tick = int(clock() / tick)
+        self._where = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay, value=None):
+        """Ставит (или переставляет) таймер key через delay секунд"""
+        self.cancel(key)
+        deadline = self.current_tick + max(1, int(-(-delay // self.tick)))
+        slot = deadline % len(self.slots)
+        self.slots[slot][key] = (deadline, value)
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self):
+        """Прокручивает колесо до текущего времени, возвращает [(key, value)] сработавших таймеров"""
+        target = int(self.clock() / self.tick)
+        expired = []
+        # После долгой паузы хватает одного полного оборота
+        if target - self.current_tick > len(self.slots):
+            self.current_tick = target - len(self.slots)
+        while self.current_tick < target:
+            self.current_tick += 1
+            bucket = self.slots[self.current_tick % len(self.slots)]
+            if not bucket:
+                continue
+            due = [key for key, (deadline, _) in bucket.items() if deadline <= self.current_tick]
+            for key in due:
+                _, value = bucket.pop(key)
+                del self._where[key]
+                expired.append((key, value))
+        return expired
@@ -0,0 +1,104 @@
+import os
+import threading
+import redis
+from sqlalchemy import text
+
+LOGIN_FLUSH_INTERVAL = float(os.environ.get('LOGIN_FLUSH_INTERVAL', '1'))
+LOGIN_FLUSH_BATCH = int(os.environ.get('LOGIN_FLUSH_BATCH', '1000'))
+
+
+class LoginBookkeeper:
+    """Буфер учета логинов: last_login и записи refresh token в Redis
+    сбрасываются фоновой задачей пачками раз в LOGIN_FLUSH_INTERVAL секунд,
+    чтобы логин не ждал commit в Postgres и setex в Redis"""
+
+    def __init__(self, app, db, table_name, auth_service, socketio,
+                 interval=LOGIN_FLUSH_INTERVAL, batch_size=LOGIN_FLUSH_BATCH):
+        self.app = app
+        self.db = db
+        self.table_name = table_name
+        self.auth_service = auth_service
+        self.socketio = socketio
+        self.interval = interval
+        self.batch_size = batch_size
+        self._last_login = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def record_login(self, user_id, at, refresh_jti=None):
+        """Ставит в очередь обновление last_login и (опционально) сессию refresh token"""
+        with self._lock:
+            prev = self._last_login.get(user_id)
+            if prev is None or at > prev:
+                self._last_login[user_id] = at
+            if refresh_jti:
+                self._sessions[refresh_jti] = user_id
+
+    def forget_session(self, refresh_jti):
+        """Убирает еще не записанную сессию (логаут до очередного сброса)"""
+        with self._lock:
+            return self._sessions.pop(refresh_jti, None) is not None
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Login bookkeeping flush error: {e}")
+
+    def flush(self):
+        with self._lock:
+            last_login, self._last_login = self._last_login, {}
+            sessions, self._sessions = self._sessions, {}
+
+        if sessions:
+            try:
+                pipe = self.auth_service.redis_client.pipeline(transaction=False)
+                for jti, user_id in sessions.items():
+                    self.auth_service.store_refresh_jti(pipe, jti, user_id)
+                pipe.execute()
+            except redis.RedisError as e:
+                print(f"Redis error: {e}")
+                self._requeue({}, sessions)
+
+        if last_login:
+            items = list(last_login.items())
+            with self.app.app_context():
+                try:
+                    for start in range(0, len(items), self.batch_size):
+                        self._update_last_login(items[start:start + self.batch_size])
+                    self.db.session.commit()
+                except Exception:
+                    self.db.session.rollback()
+                    self._requeue(last_login, {})
+                    raise
+
+    def _update_last_login(self, items):
+        # Один UPDATE ... FROM (VALUES ...) на пачку вместо commit на каждый логин
+        values = ', '.join(f"(:id{i}, :ts{i})" for i in range(len(items)))
+        params = {}
+        for i, (user_id, at) in enumerate(items):
+            params[f"id{i}"] = user_id
+            params[f"ts{i}"] = at
+        self.db.session.execute(text(
+            f'UPDATE "{self.table_name}" AS u SET last_login = v.last_login '
+            f'FROM (VALUES {values}) AS v(id, last_login) '
+            f'WHERE u.id = v.id AND (u.last_login IS NULL OR u.last_login < v.last_login)'
+        ), params)
+
+    def _requeue(self, last_login, sessions):
+        with self._lock:
+            for user_id, at in last_login.items():
+                prev = self._last_login.get(user_id)
+                if prev is None or at > prev:
+                    self._last_login[user_id] = at
+            for jti, user_id in sessions.items():
+                self._sessions.setdefault(jti, user_id)
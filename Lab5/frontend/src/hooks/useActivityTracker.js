@@ -2,9 +2,14 @@ import { useEffect, useRef } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import websocketService from '../services/websocket';
 
+// Сервер сам переводит в idle через 30 сек без активности,
+// поэтому активность подтверждается чаще этого порога
+const ACTIVITY_HEARTBEAT = 10000;
+
 const useActivityTracker = () => {
   const { user } = useAuth();
   const lastActivityRef = useRef(Date.now());
+  const lastHeartbeatRef = useRef(0);
   const statusTimerRef = useRef(null);
   const currentStatusRef = useRef('active');
 
@@ -51,6 +56,11 @@ const useActivityTracker = () => {
 
     const handleActivity = () => {
       const now = Date.now();
+
+      if (now - lastHeartbeatRef.current > ACTIVITY_HEARTBEAT) {
+        lastHeartbeatRef.current = now;
+        websocketService.sendActivity(user.id);
+      }
       const timeSinceLastActivity = now - lastActivityRef.current;
       
       // Если активность была недавно (менее 5 секунд), сбрасываем таймер
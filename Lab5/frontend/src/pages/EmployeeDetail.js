@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { ArrowLeft, Edit, Upload, Users, Calendar, DollarSign, TrendingUp } from 'lucide-react';
-import { employeesAPI } from '../services/api';
+import { employeesAPI, avatarUrl } from '../services/api';
 import toast from 'react-hot-toast';
 import EmployeeModal from '../components/EmployeeModal';
 
@@ -107,7 +107,7 @@ const EmployeeDetail = () => {
                 {employee.avatar ? (
                   <img
                     className="w-32 h-32 rounded-full mx-auto"
-                    src={`http://localhost:5000/uploads/avatars/${employee.avatar}`}
+                    src={avatarUrl(employee.avatar, 300)}
                     alt={`${employee.first_name} ${employee.last_name}`}
                   />
                 ) : (
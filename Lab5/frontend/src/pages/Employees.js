@@ -1,7 +1,8 @@
 import React, { useState, useEffect } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import { Plus, Search, Filter, Edit, Trash2, Eye, Upload, UserPlus } from 'lucide-react';
-import { employeesAPI, projectsAPI } from '../services/api';
+import { employeesAPI, projectsAPI, avatarUrl } from '../services/api';
+import websocketService from '../services/websocket';
 import toast from 'react-hot-toast';
 import EmployeeModal from '../components/EmployeeModal';
 
@@ -24,6 +25,36 @@ const Employees = () => {
     fetchProjects();
   }, [currentPage, departmentFilter]);
 
+  // Подписка на изменения сотрудников в отделах, которые сейчас на экране
+  useEffect(() => {
+    const rooms = [...new Set(employees.map(emp => `department:${emp.department}`))];
+
+    const handleEntityChanged = (change) => {
+      if (change.entity !== 'employee') {
+        return;
+      }
+      setEmployees(prev => prev.map(emp => {
+        if (String(emp.id) !== String(change.id)) {
+          return emp;
+        }
+        const { projects, ...fields } = change.changes;
+        const patched = { ...emp, ...fields };
+        if (projects) {
+          patched.projects_count = projects.length;
+        }
+        return patched;
+      }));
+    };
+
+    rooms.forEach(room => websocketService.joinRoom(room));
+    websocketService.on('entity_changed', handleEntityChanged);
+
+    return () => {
+      rooms.forEach(room => websocketService.leaveRoom(room));
+      websocketService.off('entity_changed', handleEntityChanged);
+    };
+  }, [employees.map(emp => emp.department).join('|')]);
+
   // Debounced search effect
   useEffect(() => {
     const timeoutId = setTimeout(() => {
@@ -258,9 +289,11 @@ const Employees = () => {
                       <div className="flex-shrink-0 h-10 w-10">
                         {employee.avatar ? (
                           <img
-                            className="h-10 w-10 rounded-full"
-                            src={`http://localhost:5000/uploads/avatars/${employee.avatar}`}
+                            className="h-10 w-10 rounded-full bg-cover bg-center"
+                            src={avatarUrl(employee.avatar, 96)}
                             alt={`${employee.first_name} ${employee.last_name}`}
+                            loading="lazy"
+                            style={employee.avatar_placeholder ? { backgroundImage: `url(${employee.avatar_placeholder})` } : undefined}
                           />
                         ) : (
                           <div className="h-10 w-10 rounded-full bg-gray-300 flex items-center justify-center">
@@ -1,7 +1,8 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { ArrowLeft, Edit, Plus, Users, Calendar, DollarSign } from 'lucide-react';
+import { ArrowLeft, Edit, Plus, Users, Calendar, DollarSign, Eye } from 'lucide-react';
 import { projectsAPI, employeesAPI } from '../services/api';
+import websocketService from '../services/websocket';
 import toast from 'react-hot-toast';
 import ProjectModal from '../components/ProjectModal';
 
@@ -14,12 +15,53 @@ const ProjectDetail = () => {
   const [isEditModalOpen, setIsEditModalOpen] = useState(false);
   const [isAssignModalOpen, setIsAssignModalOpen] = useState(false);
   const [availableEmployees, setAvailableEmployees] = useState([]);
+  const [viewers, setViewers] = useState({});
 
   useEffect(() => {
     fetchProject();
     fetchEmployees();
   }, [id]);
 
+  // Кто сейчас смотрит проект: обновления приходят только в комнату project:{id}
+  useEffect(() => {
+    const room = `project:${id}`;
+
+    const handleRoomPresence = (data) => {
+      if (data.room !== room) {
+        return;
+      }
+      setViewers(prev => {
+        if (data.viewers) {
+          return Object.fromEntries(data.viewers.map(v => [v.user_id, v]));
+        }
+        const next = { ...prev };
+        (data.joined || []).forEach(v => { next[v.user_id] = v; });
+        (data.left || []).forEach(userId => { delete next[userId]; });
+        return next;
+      });
+    };
+
+    // Изменения проекта патчатся на месте, изменения состава и сотрудников - перезапросом проекта
+    const handleEntityChanged = (change) => {
+      if (change.entity === 'project' && String(change.id) === String(id) && !('employees' in change.changes)) {
+        setProject(prev => (prev ? { ...prev, ...change.changes } : prev));
+      } else {
+        fetchProject();
+      }
+    };
+
+    setViewers({});
+    websocketService.on('room_presence', handleRoomPresence);
+    websocketService.on('entity_changed', handleEntityChanged);
+    websocketService.joinRoom(room);
+
+    return () => {
+      websocketService.leaveRoom(room);
+      websocketService.off('room_presence', handleRoomPresence);
+      websocketService.off('entity_changed', handleEntityChanged);
+    };
+  }, [id]);
+
   const fetchProject = async () => {
     try {
       setLoading(true);
@@ -135,6 +177,15 @@ const ProjectDetail = () => {
               <span className={`px-3 py-1 text-sm font-semibold rounded-full ${getPriorityColor(project.priority)}`}>
                 {project.priority}
               </span>
+              {Object.keys(viewers).length > 0 && (
+                <span
+                  className="flex items-center space-x-1 text-sm text-gray-500"
+                  title={Object.values(viewers).map(v => v.email).join(', ')}
+                >
+                  <Eye className="w-4 h-4" />
+                  <span>{Object.keys(viewers).length} viewing</span>
+                </span>
+              )}
             </div>
           </div>
         </div>
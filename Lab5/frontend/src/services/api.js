@@ -1,6 +1,10 @@
 import axios from 'axios';
+import websocketService from './websocket';
 
 const GRAPHQL_URL = process.env.REACT_APP_GRAPHQL_URL || 'http://localhost:5000/graphql';
+const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000/api';
+const AVATAR_POLL_MS = 2000;
+const AVATAR_TIMEOUT_MS = 60000;
 
 const client = axios.create({
   baseURL: GRAPHQL_URL,
@@ -10,6 +14,51 @@ const client = axios.create({
   withCredentials: true,
 });
 
+// Сервер выбирает рендишен по size и Accept (WebP для браузеров, которые его принимают)
+export function avatarUrl(avatar, size) {
+  const base = process.env.REACT_APP_UPLOADS_URL || 'http://localhost:5000/uploads';
+  return `${base}/avatars/${avatar}${size ? `?size=${size}` : ''}`;
+}
+
+// Аватар обрабатывается на сервере асинхронно: ждем avatar_status по WebSocket,
+// а на случай потери события периодически спрашиваем статус задачи
+function waitForAvatarJob(jobId) {
+  return new Promise((resolve, reject) => {
+    let timer = null;
+    const started = Date.now();
+
+    const finish = (job) => {
+      if (job.status === 'queued') {
+        return;
+      }
+      clearInterval(timer);
+      websocketService.off('avatar_status', onStatus);
+      if (job.status === 'ready') {
+        resolve(job);
+      } else {
+        reject(new Error(job.error || 'Avatar processing failed'));
+      }
+    };
+
+    const onStatus = (job) => {
+      if (job.job_id === jobId) {
+        finish(job);
+      }
+    };
+
+    websocketService.on('avatar_status', onStatus);
+    timer = setInterval(() => {
+      if (Date.now() - started > AVATAR_TIMEOUT_MS) {
+        finish({ status: 'failed', error: 'Avatar processing timed out' });
+        return;
+      }
+      axios.get(`${API_URL}/avatars/jobs/${jobId}`, { withCredentials: true })
+        .then(response => finish(response.data))
+        .catch(() => {});
+    }, AVATAR_POLL_MS);
+  });
+}
+
 async function graphqlRequest(query, variables = {}) {
   const resp = await client.post('', { query, variables });
   if (resp.data.errors && resp.data.errors.length) {
@@ -24,7 +73,7 @@ export const employeesAPI = {
     const query = `
       query Employees($page: Int, $per_page: Int, $search: String, $department: String) {
         employees(page: $page, per_page: $per_page, search: $search, department: $department) {
-          employees { id first_name last_name email position department hire_date salary avatar skills performance_score projects_count }
+          employees { id first_name last_name email position department hire_date salary avatar avatar_placeholder skills performance_score projects_count }
           total pages current_page
         }
       }
@@ -77,17 +126,21 @@ export const employeesAPI = {
     
     const formData = new FormData();
     formData.append('avatar', file);
-    return axios.post((process.env.REACT_APP_API_URL || 'http://localhost:5000/api') + `/employees/${id}/avatar`, formData, {
+    return axios.post(`${API_URL}/employees/${id}/avatar`, formData, {
       withCredentials: true,
       headers: { 'Content-Type': 'multipart/form-data' },
-    }).then(response => {
-      
+    }).then(async response => {
+      // Имя файла (хеш содержимого) известно только после обработки
+      const filename = response.data.status === 'ready'
+        ? response.data.filename
+        : (await waitForAvatarJob(response.data.job_id)).filename;
+
       const mutation = `
         mutation UploadAvatar($employeeId: ID!, $filename: String!) {
           uploadAvatar(employeeId: $employeeId, filename: $filename) { message }
         }
       `;
-      return graphqlRequest(mutation, { employeeId: id, filename: response.data.filename });
+      return graphqlRequest(mutation, { employeeId: id, filename });
     });
   },
 };
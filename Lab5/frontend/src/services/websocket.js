@@ -1,10 +1,83 @@
 import { io } from 'socket.io-client';
+import msgpackParser from 'socket.io-msgpack-parser';
+
+// Должно совпадать с SOCKETIO_SERIALIZER=msgpack на сервере
+const USE_MSGPACK = process.env.REACT_APP_WS_MSGPACK === 'true';
+const STATUS_NAMES = ['active', 'idle', 'offline'];
+
+// Компактная запись присутствия {u, e, r, t, s} -> прежний вид
+const decodeEntry = (entry) => {
+  if (!USE_MSGPACK) {
+    return entry;
+  }
+  const decoded = { user_id: entry.u };
+  if (entry.e !== undefined) decoded.email = entry.e;
+  if (entry.r !== undefined) decoded.role = entry.r;
+  if (entry.t !== undefined) decoded.last_seen = new Date(entry.t * 1000).toISOString();
+  if (entry.s !== undefined) decoded.status = STATUS_NAMES[entry.s];
+  return decoded;
+};
+
+const decodeSnapshot = (snapshot) => {
+  if (!USE_MSGPACK) {
+    return snapshot;
+  }
+  return {
+    version: snapshot.v,
+    users: Object.fromEntries(snapshot.u.map(e => [e.u, decodeEntry(e)]))
+  };
+};
+
+const decodeDelta = (delta) => {
+  if (!USE_MSGPACK) {
+    return delta;
+  }
+  return {
+    version: delta.v,
+    joined: delta.j.map(decodeEntry),
+    left: delta.l,
+    changed: delta.c.map(decodeEntry)
+  };
+};
+
+const OP_NAMES = ['create', 'update', 'delete'];
+
+// Дельты разных процессов сервера приходят через очередь сообщений не
+// обязательно по порядку версий: столько ждем недостающую, прежде чем
+// запросить полный снимок
+const PRESENCE_GAP_TIMEOUT = 3000;
+
+// Компактное entity_changed {n, i, o, c, v, d, t} -> прежний вид; поля из d
+// (даты) и t (время) приходят секундами epoch и возвращаются в ISO
+const decodeChange = (change) => {
+  if (!USE_MSGPACK) {
+    return change;
+  }
+  const changes = { ...change.c };
+  (change.d || []).forEach(name => {
+    if (changes[name] != null) changes[name] = new Date(changes[name] * 1000).toISOString().slice(0, 10);
+  });
+  (change.t || []).forEach(name => {
+    if (changes[name] != null) changes[name] = new Date(changes[name] * 1000).toISOString();
+  });
+  return {
+    entity: change.n,
+    id: change.i,
+    op: OP_NAMES[change.o],
+    changes,
+    version: change.v
+  };
+};
 
 class WebSocketService {
   constructor() {
     this.socket = null;
     this.isConnected = false;
     this.listeners = new Map();
+    this.presence = { version: 0, users: {} };
+    this.pendingDeltas = new Map();
+    this.gapTimer = null;
+    this.rooms = new Set();
   }
 
   connect(userId, userEmail, userRole) {
@@ -17,7 +90,8 @@ class WebSocketService {
         withCredentials: true,
         transports: ['websocket', 'polling'],
         timeout: 5000,
-        forceNew: true
+        forceNew: true,
+        ...(USE_MSGPACK ? { parser: msgpackParser } : {})
       });
     } catch (error) {
       console.warn('Failed to create WebSocket connection:', error);
@@ -27,13 +101,10 @@ class WebSocketService {
     this.socket.on('connect', () => {
       console.log('WebSocket connected');
       this.isConnected = true;
-      
-      
-      this.socket.emit('user_online', {
-        user_id: userId,
-        user_email: userEmail,
-        user_role: userRole
-      });
+
+      // Личность сервер берет из cookie access_token при подключении
+      this.socket.emit('user_online');
+      this.rooms.forEach(room => this.socket.emit('join_room', { room }));
     });
 
     this.socket.on('disconnect', () => {
@@ -59,21 +130,88 @@ class WebSocketService {
       this.emit('active_users', users);
     });
 
-    this.socket.on('user_joined_room', (data) => {
-      this.emit('user_joined_room', data);
+    this.socket.on('room_presence', (data) => {
+      this.emit('room_presence', {
+        ...data,
+        ...(data.viewers ? { viewers: data.viewers.map(decodeEntry) } : {}),
+        ...(data.joined ? { joined: data.joined.map(decodeEntry) } : {})
+      });
+    });
+
+    this.socket.on('entity_changed', (data) => {
+      this.emit('entity_changed', decodeChange(data));
     });
 
-    this.socket.on('user_left_room', (data) => {
-      this.emit('user_left_room', data);
+    this.socket.on('avatar_status', (data) => {
+      this.emit('avatar_status', data);
     });
 
     this.socket.on('user_status_changed', (data) => {
       this.emit('user_status_changed', data);
     });
 
-    this.socket.on('users_status_update', (data) => {
-      this.emit('users_status_update', data);
+    // Сервер присылает полный снимок при подключении, дальше только дельты
+    this.socket.on('presence_snapshot', (data) => {
+      const snapshot = decodeSnapshot(data);
+      this.presence = { version: snapshot.version, users: snapshot.users };
+      this.drainPresenceDeltas();
+      this.emit('users_status_update', this.presence.users);
     });
+
+    this.socket.on('presence_delta', (delta) => {
+      this.applyPresenceDelta(decodeDelta(delta));
+    });
+  }
+
+  applyPresenceDelta(delta) {
+    if (delta.version <= this.presence.version) {
+      return;
+    }
+    // Дельты копятся и применяются строго по версиям
+    this.pendingDeltas.set(delta.version, delta);
+    if (this.drainPresenceDeltas()) {
+      this.emit('users_status_update', this.presence.users);
+    }
+  }
+
+  drainPresenceDeltas() {
+    // Применяет накопленные дельты подряд от текущей версии; true, если что-то изменилось
+    let users = null;
+    for (const version of [...this.pendingDeltas.keys()]) {
+      if (version <= this.presence.version) {
+        this.pendingDeltas.delete(version);
+      }
+    }
+    let next = this.pendingDeltas.get(this.presence.version + 1);
+    while (next) {
+      this.pendingDeltas.delete(next.version);
+      users = users || { ...this.presence.users };
+      next.joined.forEach(entry => {
+        users[entry.user_id] = entry;
+      });
+      next.changed.forEach(entry => {
+        users[entry.user_id] = { ...users[entry.user_id], ...entry };
+      });
+      next.left.forEach(userId => {
+        delete users[userId];
+      });
+      this.presence = { version: next.version, users };
+      next = this.pendingDeltas.get(this.presence.version + 1);
+    }
+
+    if (this.pendingDeltas.size === 0) {
+      clearTimeout(this.gapTimer);
+      this.gapTimer = null;
+    } else if (!this.gapTimer) {
+      this.gapTimer = setTimeout(() => {
+        this.gapTimer = null;
+        if (this.pendingDeltas.size > 0 && this.socket) {
+          // Недостающая дельта так и не пришла - запрашиваем полный снимок
+          this.socket.emit('presence_sync');
+        }
+      }, PRESENCE_GAP_TIMEOUT);
+    }
+    return users !== null;
   }
 
   disconnect() {
@@ -81,13 +219,17 @@ class WebSocketService {
       this.socket.disconnect();
       this.socket = null;
       this.isConnected = false;
+      this.presence = { version: 0, users: {} };
+      this.pendingDeltas.clear();
+      clearTimeout(this.gapTimer);
+      this.gapTimer = null;
     }
   }
 
   sendActivity(userId) {
     try {
       if (this.socket && this.isConnected) {
-        this.socket.emit('user_activity', { user_id: userId });
+        this.socket.emit('user_activity');
       }
     } catch (error) {
       console.warn('Failed to send activity via WebSocket:', error);
@@ -97,7 +239,7 @@ class WebSocketService {
   sendStatusUpdate(userId, status) {
     try {
       if (this.socket && this.isConnected) {
-        this.socket.emit('user_status_update', { user_id: userId, status: status });
+        this.socket.emit('user_status_update', { status: status });
       }
     } catch (error) {
       console.warn('Failed to send status update via WebSocket:', error);
@@ -107,7 +249,7 @@ class WebSocketService {
   sendUserOffline(userId) {
     try {
       if (this.socket && this.isConnected) {
-        this.socket.emit('user_offline', { user_id: userId });
+        this.socket.emit('user_offline');
       }
     } catch (error) {
       console.warn('Failed to send user offline via WebSocket:', error);
@@ -116,15 +258,18 @@ class WebSocketService {
 
 
   joinRoom(room, userId) {
+    // Комнаты запоминаются и повторно занимаются после переподключения
+    this.rooms.add(room);
     if (this.socket && this.isConnected) {
-      this.socket.emit('join_room', { room, user_id: userId });
+      this.socket.emit('join_room', { room });
     }
   }
 
 
   leaveRoom(room, userId) {
+    this.rooms.delete(room);
     if (this.socket && this.isConnected) {
-      this.socket.emit('leave_room', { room, user_id: userId });
+      this.socket.emit('leave_room', { room });
     }
   }
 